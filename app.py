@@ -1,5 +1,9 @@
+from datetime import datetime, timedelta, timezone
+
+import click
+
 from fixtures import import_example_data
-from supermarket import App, model
+from supermarket import App, export, model, scoring
 
 app = App("supermarket")
 
@@ -19,3 +23,36 @@ def _make_shell_context():
 def fixture_example_data():
     """Reset database and import example data from fixtures."""
     import_example_data()
+
+
+@app.cli.command()
+def refresh_label_hotspots():
+    """Rebuild the label → hotspot index from the label criteria."""
+    model.refresh_label_hotspots(model.db.session)
+    model.db.session.commit()
+
+
+@app.cli.command()
+def refresh_product_scores():
+    """Recompute the scores of all products."""
+    scoring.refresh_product_scores(model.db.session)
+    model.db.session.commit()
+
+
+@app.cli.command()
+def prune_tombstones():
+    """Forget deleted rows older than `TOMBSTONE_RETENTION_DAYS`."""
+    retention = timedelta(days=app.config["TOMBSTONE_RETENTION_DAYS"])
+    pruned = model.prune_tombstones(model.db.session, datetime.now(timezone.utc) - retention)
+    model.db.session.commit()
+    click.echo("Pruned {} tombstones.".format(pruned))
+
+
+@app.cli.command()
+@click.option("--sheet", type=click.Choice(export.SHEETS), default="products")
+@click.option("--lang", default="en")
+@click.argument("output", type=click.File("w"), default="-")
+def export_products_csv(sheet, lang, output):
+    """Export all products as CSV in the format of the example data."""
+    for text in export.write_csv(export.product_rows(model.db.session, sheet, lang)):
+        output.write(text)
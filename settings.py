@@ -10,6 +10,7 @@ class TestingConfig(Common):
     TESTING = True
     SECRET_KEY = b"Testing secret key"
     SQLALCHEMY_DATABASE_URI = "postgresql:///supermarket_test"
+    RESPONSE_CACHE = None  # enabled explicitly by the tests for it
 
 
 class DevelopmentConfig(Common):
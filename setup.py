@@ -20,6 +20,7 @@ setup(
         "Flask-RESTful",
         "Flask-SQLAlchemy",
         "marshmallow-sqlalchemy" "moflask",
+        "numpy",
     ],
     dependency_links=[
         "git+https://github.com/moreonion/moflask.git@master#egg=moflask-0.1",
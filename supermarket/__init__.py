@@ -1,17 +1,22 @@
 from flask_cors import CORS
 from moflask.flask import BaseApp
 
+from . import scoring  # noqa: F401 (registers the score updates)
 from .api import app as api_app
 from .authentication import Auth0
+from .cache import response_cache
 from .model import db
-from .schema import ma
+from .schema import init_field_metadata, ma
 
 
 class App(BaseApp):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.config.setdefault("TOMBSTONE_RETENTION_DAYS", 30)
         db.init_app(self)
         ma.init_app(self)
+        init_field_metadata()
+        response_cache.init_app(self)
         CORS(allow_headers=["Authorization", "Content-Type"]).init_app(self)
         Auth0().init_app(self)
         self.register_blueprint(api_app, url_prefix="/api/v1")
@@ -1,15 +1,32 @@
+import base64
+import binascii
+import json
 import operator
 import re
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, wraps
+from itertools import islice
 
-from flask import Blueprint, request
+from flask import Blueprint, Response, abort, current_app, request, stream_with_context
 from flask_restful import Api, Resource as BaseResource
+from flask_restful.utils import unpack
+from flask_sqlalchemy import Pagination
+from sqlalchemy import Float, and_, cast, column, false, func, or_, select, text
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.inspection import inspect
+from sqlalchemy.orm import joinedload, load_only, noload, selectinload
+from sqlalchemy.sql.expression import ClauseElement, Executable
 from werkzeug.datastructures import MultiDict
 from werkzeug.exceptions import HTTPException
+from werkzeug.http import http_date, quote_etag
 
 import supermarket.model as m
 import supermarket.schema as s
+from supermarket import export
 from supermarket.authentication import Auth0
+from supermarket.cache import response_cache
+from supermarket.risk import get_risk_matrix
+from supermarket.scoring import hotspot_profiles
 
 app = Blueprint("api", __name__)
 api = Api(app)
@@ -32,12 +49,10 @@ class ValidationFailed(HTTPException):
     """
 
     code = 400
-    data = {}
 
     def __init__(self, errors, description="Validation error."):
         super().__init__()
-        self.data["message"] = description
-        self.data["errors"] = []
+        self.data = {"message": description, "errors": []}
         for f, msg in errors.items():
             self.data["errors"].append({"field": f, "messages": msg})
 
@@ -69,6 +84,75 @@ class FilterOperatorException(ParamException):
         super(ParamException).__init__(*args, **kwargs)
 
 
+# Query helpers
+
+
+class Explain(Executable, ClauseElement):
+
+    """Get the query plan of a statement in JSON format.
+
+    :param obj statement    The statement to explain.
+
+    """
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain, "postgresql")
+def _compile_explain(element, compiler, **kwargs):
+    return "EXPLAIN (FORMAT JSON) {}".format(compiler.process(element.statement, **kwargs))
+
+
+class Page(Pagination):
+
+    """A page of items that doesn’t depend on the total number of items to find the next page.
+
+    :param int total    Number of items, may be an estimate or `None` if it’s unknown.
+    :param bool more    Whether there are items following this page.
+    :param str count    How the total number was determined: ‘exact’, ‘estimate’ or ‘none’.
+
+    """
+
+    def __init__(self, query, page, per_page, total, items, more, count):
+        super().__init__(query, page, per_page, total, items)
+        self.more = more
+        self.count = count
+
+    @property
+    def pages(self):
+        """The total number of pages (if the total number of items is known)."""
+        if self.total is None:
+            return None
+        return max(super().pages, self.page + 1 if self.more else self.page)
+
+    @property
+    def has_next(self):
+        """True if a next page exists."""
+        return self.more
+
+
+class QueryContext:
+
+    """State of a single request, passed along while querying and dumping.
+
+    Resources are shared by all requests, so anything specific to a request lives here.
+
+    Attributes:
+        language    Language for translated content or `None` for all translations.
+        only        Field names to return or `None` for all fields.
+        include     Fields to include as returned by `GenericResource._parse_include_params`.
+        errors      Collection where caught errors should be added.
+
+    """
+
+    def __init__(self, language=None, only=None):
+        self.language = language
+        self.only = only
+        self.include = {}
+        self.errors = []
+
+
 # Resources
 
 
@@ -85,50 +169,91 @@ class GenericResource:
     def __init__(self, model, schema):
         self.model = model
         self.schema = schema
+        self._resolve_field = lru_cache(maxsize=1024)(self._resolve_field)
+        self._tables = None
 
-    def _field_to_attr(self, field, query):
-        # Get the attribute of a model class by field name and update the query if necessary.
+    @property
+    def tables(self):
+        """Names of the tables responses for this resource may be read from.
+
+        Includes the tables of the model, of related models and of models related to those,
+        so that nested, related and included items are covered.
+
+        """
+        if self._tables is None:
+            tables = set()
+            models = [inspect(self.model)]
+            for _ in range(3):
+                related = []
+                for mapper in models:
+                    tables.update(t.name for t in mapper.tables)
+                    for relationship in mapper.relationships:
+                        if relationship.secondary is not None:
+                            tables.add(relationship.secondary.name)
+                        related.append(relationship.mapper)
+                models = related
+            self._tables = sorted(tables)
+        return self._tables
+
+    def _resolve_field(self, field):
+        # Resolve a field path to the attribute it refers to.
         #
-        # Returns a :class:`~sqlalchemy.orm.attributes.InstrumentedAttribute` matching
-        # the field name and the query joined with the table that contains the attribute.
+        # Returns a tuple of the :class:`~sqlalchemy.orm.attributes.InstrumentedAttribute`,
+        # the relationship attributes to join (if any), the remaining subfield names for
+        # JSON fields and the resource of the attribute’s table (or `None`).
         # Raises a :class:`~supermarket.api.ParamException` if the field can’t be matched.
+        # Results are memoized per resource, see `__init__`.
         #
         # :param str field  Field name, may include subfield names joined with ‘.’ for
         #                   JSON fields or one level of nested and related fields.
-        # :param obj query  Query of type :class:`~flask_sqlalchemy.BaseQuery` to update.
         #
         model = self.model
-        schema = self.schema()
+        schema = self.schema
         keys = field.strip().split(".")
         field = keys.pop(0)
+        relations = ()
 
-        if field in schema.nested_fields:
-            schema = schema.fields[field].nested
+        if field in schema.field_metadata()["nested"]:
+            schema = schema._declared_fields[field].nested
             if isinstance(schema, str):
                 schema = s.class_registry.get_class(schema)
-            model = getattr(model, field).property.mapper.class_
+            relations += (getattr(model, field),)
+            model = relations[-1].property.mapper.class_
             field = keys.pop(0) if keys else inspect(model).primary_key[0].name
-            schema = schema()
 
-        if field in schema.related_fields + schema.related_lists:
-            relation = getattr(model, field)
-            query = query.outerjoin(relation)
-            model = relation.property.mapper.class_
+        metadata = schema.field_metadata()
+        if field in metadata["related"] | metadata["related_lists"]:
+            relations += (getattr(model, field),)
+            model = relations[-1].property.mapper.class_
             field = keys.pop(0) if keys else inspect(model).primary_key[0].name
 
         attr = getattr(model, field, None)
-        if not hasattr(attr, "type"):  # not a proper column
-            attr = None
-        elif isinstance(attr.type, m.JSONB) and keys:
-            attr = attr[keys].astext
-        elif isinstance(attr.type, m.Translation) and getattr(self, "language", None):
-            attr = attr[self.language].astext
-        elif keys:  # not a perfect match after all
-            attr = None
-
-        if attr is None:
+        if not hasattr(attr, "type") or (keys and not isinstance(attr.type, m.JSONB)):
             raise ParamException("Unknown field `{}` for `{}`.".format(field, model.__tablename__))
 
+        return (attr, relations, tuple(keys), resources_by_table.get(attr.table))
+
+    def _field_to_attr(self, field, query, context):
+        # Get the attribute of a model class by field name and update the query if necessary.
+        #
+        # Returns a :class:`~sqlalchemy.orm.attributes.InstrumentedAttribute` matching
+        # the field name and the query joined with the table that contains the attribute.
+        # Raises a :class:`~supermarket.api.ParamException` if the field can’t be matched.
+        #
+        # :param str field  Field name, may include subfield names joined with ‘.’ for
+        #                   JSON fields or one level of nested and related fields.
+        # :param obj query  Query of type :class:`~flask_sqlalchemy.BaseQuery` to update.
+        # :param obj context  The :class:`~supermarket.api.QueryContext` of the request.
+        #
+        (attr, relations, keys, _) = self._resolve_field(field)
+        if relations:
+            query = query.outerjoin(*relations)
+
+        if isinstance(attr.type, m.JSONB) and keys:
+            attr = attr[list(keys)].astext
+        elif isinstance(attr.type, m.Translation) and context.language:
+            attr = attr[context.language].astext
+
         return (attr, query)
 
     def _find_filter(self, field):
@@ -140,7 +265,7 @@ class GenericResource:
         #
         return self._default_filter
 
-    def _default_filter(self, query, field, op, value):
+    def _default_filter(self, query, field, op, value, context):
         # Default filter method, filters `field` by `value` using `op`.
         #
         # Returns the filtered query.
@@ -151,9 +276,10 @@ class GenericResource:
         # :param str op         Operator to use for filtering,
         #                       accepts ‘lt’, ‘le’, ‘eq’, ‘ne’, ‘ge’, ‘gt’, ‘in’, ‘like’.
         # :param str value      Value to filter by.
+        # :param obj context    The :class:`~supermarket.api.QueryContext` of the request.
         #
         accepted_operators = ["lt", "le", "eq", "ne", "ge", "gt", "in", "like"]
-        (attr, query) = self._field_to_attr(field, query)
+        (attr, query) = self._field_to_attr(field, query, context)
 
         if op not in accepted_operators:
             raise FilterOperatorException(op, accepted_operators)
@@ -174,15 +300,15 @@ class GenericResource:
             query = query.filter(op(attr, value))
         return query
 
-    def _filter(self, query, filter_fields, errors):
+    def _filter(self, query, filter_fields, context):
         # Go through `filter_fields` and apply a matching filter to the `query`.
         #
-        # Adds any errors to `errors` and returns the filtered query.
+        # Adds any errors to the `context` and returns the filtered query.
         #
         # :param obj query            Query of type :class:`~flask_sqlalchemy.BaseQuery` to filter.
         # :param dict filter_fields   A :class:`~werkzeug.datastructures.MultiDict` containing
         #                             request parameters to be regarded as filters.
-        # :param dict errors          Collection where caught errors should be added.
+        # :param obj context          The :class:`~supermarket.api.QueryContext` of the request.
         #
         not_filtered = []
         for key, value in filter_fields.items(multi=True):
@@ -190,42 +316,177 @@ class GenericResource:
             filter = self._find_filter(field)
 
             try:
-                query = filter(query, field, op, value)
+                query = filter(query, field, op, value, context)
             except ParamException as pe:
                 not_filtered.append({"param": key, "message": str(pe.message)})
         if not_filtered:
-            errors.append({"errors": not_filtered, "message": "Some parameters have been ignored."})
+            context.errors.append(
+                {"errors": not_filtered, "message": "Some parameters have been ignored."}
+            )
         return query
 
-    def _sort(self, query, sort_fields, errors):
+    def _sort(self, query, sort_fields, context):
         # Go through `sort_fields` and sort the `query` accordingly.
         #
-        # Adds any errors to `errors` and returns the sorted query.
+        # Adds any errors to the `context` and returns the sorted query and a list of
+        # (attribute, descending) tuples describing the sort order.
         #
         # :param obj query           Query of type :class:`~flask_sqlalchemy.BaseQuery` to filter.
         # :param str sort_fields     The field name, or multiple field names seperated by ‘,’,
         #                            to sort by, may be preceeded by ‘-’ to sort decending.
-        # :param dict errors         Collection where caught errors should be added.
+        # :param obj context         The :class:`~supermarket.api.QueryContext` of the request.
         #
         if not sort_fields:
-            return query
+            return (query, [])
         fields = []
+        order = []
         not_sorted = []
         for value in sort_fields.split(","):
             field = value.split("-")[-1]
-            order = "desc" if value[0] == "-" else "asc"
+            desc = value[0] == "-"
             try:
-                (attr, query) = self._field_to_attr(field, query)
-                if order == "desc":
-                    attr = attr.desc()
-                fields.append(attr)
+                (attr, query) = self._field_to_attr(field, query, context)
+                fields.append(attr.desc() if desc else attr)
+                order.append((attr, desc))
             except ParamException as pe:
                 not_sorted.append({"value": value, "message": pe.message})
         if not_sorted:
-            errors.append(
+            context.errors.append(
                 {"errors": not_sorted, "message": "Some values have been ignored for sorting."}
             )
-        return query.order_by(*fields)
+        return (query.order_by(*fields), order)
+
+    def _encode_cursor(self, key, values):
+        # Encode the sort key and the values of the last item on a page as an opaque string.
+        data = json.dumps({"key": key, "values": values}, default=str, separators=(",", ":"))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+    def _decode_cursor(self, cursor, key):
+        # Decode a cursor created by `_encode_cursor` and return the values it contains.
+        #
+        # Raises a :class:`~supermarket.api.ParamException` if the cursor is invalid or
+        # doesn’t match the current sort key.
+        #
+        try:
+            data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            data = json.loads(data.decode())
+            values = data["values"]
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError):
+            raise ParamException("Invalid cursor.")
+        if data.get("key") != key or not isinstance(values, list):
+            raise ParamException("The cursor doesn’t match the sort order.")
+        return values
+
+    def _changed_since(self, query, since, context):
+        # Restrict a query to the items changed since the time in a sync token.
+        #
+        # Adds any errors to the `context` and returns the query, the IDs of the items deleted
+        # since then and the sync token to use for the next sync. The new token is taken
+        # before the items are loaded so that no change falls between two syncs. Tokens older
+        # than `TOMBSTONE_RETENTION_DAYS` are rejected, deletions before then aren’t known.
+        #
+        # :param obj query      Query of type :class:`~flask_sqlalchemy.BaseQuery` to filter.
+        # :param str since      The sync token, empty to get all items.
+        # :param obj context    The :class:`~supermarket.api.QueryContext` of the request.
+        #
+        sync = self._encode_cursor("sync", [m.sync_time(m.db.session).isoformat()])
+        if not since:
+            return (query, [], sync)
+        try:
+            values = self._decode_cursor(since, "sync")
+            time = datetime.fromisoformat(values[0])
+        except (ParamException, ValueError, TypeError, IndexError):
+            context.errors.append(
+                {
+                    "errors": [{"param": "since", "message": "Invalid sync token."}],
+                    "message": "Some parameters have been ignored.",
+                }
+            )
+            return (query, [], sync)
+        retention = timedelta(days=current_app.config["TOMBSTONE_RETENTION_DAYS"])
+        if time < datetime.now(timezone.utc) - retention:
+            raise ValidationFailed(
+                {"since": ["The sync token has expired, a full resync is required."]},
+                "Invalid parameters.",
+            )
+        table = self.model.__table__.name
+        deleted = [identity[0] for identity in m.deleted_since(m.db.session, table, time)]
+        return (query.filter(self.model.updated_at >= time), deleted, sync)
+
+    def _after(self, order, values):
+        # Build a filter for rows following `values` in the sort `order` (keyset pagination).
+        #
+        # PostgreSQL puts NULL values last when sorting ascending and first when sorting
+        # descending, so NULL values are handled accordingly.
+        #
+        # :param list order     List of (attribute, descending) tuples.
+        # :param list values    Values of the last item on the previous page.
+        #
+        clauses = []
+        equal = []
+        for (attr, desc), value in zip(order, values):
+            if value is None:
+                after = attr.isnot(None) if desc else false()
+            elif desc:
+                after = attr < value
+            else:
+                after = or_(attr > value, attr.is_(None))
+            clauses.append(and_(*equal, after))
+            equal.append(attr.is_(None) if value is None else attr == value)
+        return or_(*clauses)
+
+    def _cursor_page(self, query, order, cursor, limit, key, context, columns=()):
+        # Get the items following the `cursor` position (keyset pagination).
+        #
+        # Instead of counting items and skipping pages, the query continues after the sort
+        # values of the last item on the previous page, which is just as fast for every page.
+        # Adds any errors to the `context` and returns the items and pagination info.
+        #
+        # :param obj query      Query of type :class:`~flask_sqlalchemy.BaseQuery` to page.
+        # :param list order     List of (attribute, descending) tuples as returned by `_sort`.
+        # :param str cursor     The cursor parameter, empty for the first page.
+        # :param int limit      Maximum number of items per page.
+        # :param str key        Describes the sort order, cursors for other orders are rejected.
+        # :param obj context    The :class:`~supermarket.api.QueryContext` of the request.
+        # :param list columns   Additional columns to select with each item.
+        #
+        if limit < 1:
+            raise ValidationFailed({"limit": ["Must be at least 1."]}, "Invalid parameters.")
+        pk = getattr(self.model, inspect(self.model).primary_key[0].name)
+        order = order + [(pk, False)]
+        query = query.order_by(pk)
+        if cursor:
+            try:
+                values = self._decode_cursor(cursor, key)
+                if len(values) != len(order):
+                    raise ParamException("The cursor doesn’t match the sort order.")
+                query = query.filter(self._after(order, values))
+            except ParamException as pe:
+                context.errors.append(
+                    {
+                        "errors": [{"param": "cursor", "message": pe.message}],
+                        "message": "Some parameters have been ignored.",
+                    }
+                )
+        cursor_columns = [attr.label("cursor_{}".format(i)) for i, (attr, _) in enumerate(order)]
+        rows = query.add_columns(*columns, *cursor_columns).limit(limit + 1).all()
+
+        next_cursor = False
+        next_url = False
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self._encode_cursor(key, list(rows[-1][-len(order) :]))
+            if re.search("[?&]cursor=", request.url):
+                next_url = re.sub(
+                    "(?<=[?&])cursor=[^&]*", "cursor={}".format(next_cursor), request.url
+                )
+            elif request.args:
+                next_url = "{}&cursor={}".format(request.url, next_cursor)
+            else:
+                next_url = "{}?cursor={}".format(request.url, next_cursor)
+        pages = {"next_cursor": next_cursor, "next_url": next_url}
+        items = [row[: -len(order)] if columns else row[0] for row in rows]
+        return (items, pages)
 
     def _sanitize_only(self, only_fields):
         # Converts a string of field names to a list of valid existing field names.
@@ -238,8 +499,297 @@ class GenericResource:
                 sanitized.append(field)
         return sanitized
 
+    def _relation_tree(self, model, schema, preloaded=()):
+        # Get the relationships of `model` that are needed to dump `schema`.
+        #
+        # Returns a tree of relationship names as nested dicts, including relationships
+        # needed by nested schemas and by the hyperlinks in `links`. Links built from the
+        # owner’s own key don’t need their relationship loaded.
+        #
+        # :param obj model      The :class:`~flask_sqlalchemy.Model` class being dumped.
+        # :param obj schema     The :class:`~supermarket.schema.CustomSchema` instance to dump.
+        # :param set preloaded  Relationships that are only dumped as keys or links and
+        #                       whose keys are loaded separately, see `_related_keys`.
+        #
+        relationships = inspect(model).relationships
+        tree = {}
+        for key, field in schema.fields.items():
+            if key == "links":
+                for link in field.schema.get("related", {}).values():
+                    if isinstance(link, s.HyperlinkRelatedList) and (
+                        link.attribute in preloaded or link.owner_key(model) is not None
+                    ):
+                        continue
+                    tree.setdefault(link.attribute, {})
+            elif isinstance(field, s.RelatedList) and key in preloaded:
+                continue
+            elif key in relationships:
+                subtree = tree.setdefault(key, {})
+                if isinstance(field, s.Nested):
+                    nested_schema = field.nested
+                    if isinstance(nested_schema, str):
+                        nested_schema = s.class_registry.get_class(nested_schema)
+                    nested_schema = nested_schema(only=field.only, exclude=field.exclude)
+                    nested_model = relationships[key].mapper.class_
+                    _merge_tree(subtree, self._relation_tree(nested_model, nested_schema))
+        return tree
+
+    def _columns(self, model, schema, tree):
+        # Get the names of the columns of `model` that are needed to dump `schema`.
+        #
+        # Besides the columns of the dumped fields, this includes the primary key, the
+        # columns used to load the relationships in `tree` and those links are built from.
+        #
+        # :param obj model      The :class:`~flask_sqlalchemy.Model` class being dumped.
+        # :param obj schema     The :class:`~supermarket.schema.CustomSchema` instance to dump.
+        # :param dict tree      The relationships to load as returned by `_relation_tree`.
+        #
+        mapper = inspect(model)
+        columns = set(mapper.get_property_by_column(c).key for c in mapper.primary_key)
+        for key, field in schema.fields.items():
+            if (field.attribute or key) in mapper.column_attrs:
+                columns.add(field.attribute or key)
+            elif key == "links":
+                for link in field.schema.get("related", {}).values():
+                    if isinstance(link, s.HyperlinkRelatedList) and link.owner_key(model):
+                        columns.add(link.owner_key(model))
+        for key in tree:
+            for column in mapper.relationships[key].local_columns:
+                columns.add(mapper.get_property_by_column(column).key)
+        return columns
+
+    def _load_options(self, schema):
+        # Plan how related items are loaded when dumping `schema`.
+        #
+        # Returns query options that load all relationships needed for dumping in a fixed
+        # number of queries: collections with a ‘SELECT … IN’, single items with a join.
+        # Relationships and columns that aren’t needed are not loaded at all, neither on the
+        # model nor on related models.
+        #
+        # :param obj schema     The :class:`~supermarket.schema.CustomSchema` instance to dump.
+        #
+        preloaded = set(attribute for (attribute, _) in self._preloaded_lists(schema))
+        tree = self._relation_tree(self.model, schema, preloaded)
+        options = [
+            noload(getattr(self.model, key))
+            for key in inspect(self.model).relationships.keys()
+            if key not in tree
+        ]
+        columns = self._columns(self.model, schema, tree)
+        if len(columns) < len(inspect(self.model).column_attrs):
+            options.append(load_only(*columns))
+
+        def add_options(model, tree, loader):
+            for key, subtree in tree.items():
+                attr = getattr(model, key)
+                if loader is None:
+                    option = selectinload(attr) if attr.property.uselist else joinedload(attr)
+                elif attr.property.uselist:
+                    option = loader.selectinload(attr)
+                else:
+                    option = loader.joinedload(attr)
+                related = attr.property.mapper
+                options.extend(
+                    option.noload(getattr(related.class_, k))
+                    for k in related.relationships.keys()
+                    if k not in subtree
+                )
+                if subtree:
+                    add_options(attr.property.mapper.class_, subtree, option)
+                else:
+                    options.append(option)
+
+        add_options(self.model, tree, None)
+        return options
+
+    def _translated_fields(self, context):
+        # Get the keys of translated fields to select in the requested language with SQL.
+        #
+        # Returns an empty list if all translations are requested.
+        #
+        # :param obj context    The :class:`~supermarket.api.QueryContext` of the request.
+        #
+        if not context.language:
+            return []
+        translated = self.schema.field_metadata()["translated"]
+        return sorted(f for f in translated if not context.only or f in context.only)
+
+    def _translation_columns(self, keys, context):
+        # Get columns that select the translations of the fields `keys` in the requested language.
+        #
+        # Like :meth:`~supermarket.schema.CustomSchema.filter_translations_by_language`,
+        # falls back to the default language and then to any available translation,
+        # but only the selected translation is read from the database.
+        #
+        # :param list keys      Keys of translated fields as returned by `_translated_fields`.
+        # :param obj context    The :class:`~supermarket.api.QueryContext` of the request.
+        #
+        columns = []
+        for key in keys:
+            attr = getattr(self.model, self.schema._declared_fields[key].attribute or key)
+            first = (
+                select([column("value", type_=m.JSONB)])
+                .select_from(func.jsonb_each(attr))
+                .limit(1)
+                .as_scalar()
+            )
+            translation = func.coalesce(
+                attr[context.language], attr[self.schema.default_language], first, attr
+            )
+            columns.append(translation.label("translated_{}".format(key)))
+        return columns
+
+    def _preloaded_lists(self, schema):
+        # Get the "many" relationships that are only dumped as keys or links.
+        #
+        # Returns a set of (attribute, column) tuples: the name of the relationship and
+        # of the related column used as key.
+        #
+        # :param obj schema     The :class:`~supermarket.schema.CustomSchema` instance to dump.
+        #
+        fields = []
+        for key, field in schema.fields.items():
+            if key == "links":
+                for link in field.schema.get("related", {}).values():
+                    if isinstance(link, s.HyperlinkRelatedList):
+                        if link.owner_key(self.model) is None:
+                            fields.append((link.attribute, link.columns))
+            elif isinstance(field, s.RelatedList):
+                fields.append((field.attribute or key, field.container.columns))
+        lists = set()
+        for (attribute, columns) in fields:
+            column = s.related_key_column(self.model, attribute, tuple(columns))
+            if column is not None:
+                lists.add((attribute, column))
+        return lists
+
+    def _related_keys(self, schema, items):
+        # Load the keys of items related to `items` that are only dumped as keys or links.
+        #
+        # Returns a dict mapping (identity key, attribute, column) tuples to the list of keys,
+        # loaded with one query per relationship for all `items`.
+        #
+        # :param obj schema     The :class:`~supermarket.schema.CustomSchema` instance to dump.
+        # :param list items     The items that will be dumped.
+        #
+        lists = self._preloaded_lists(schema)
+        if not lists or not items:
+            return {}
+        primary_key = inspect(self.model).primary_key[0].name
+        pk = getattr(self.model, primary_key)
+        ids = [getattr(i, primary_key) for i in items]
+        related_keys = {}
+        for (attribute, column) in lists:
+            relation = getattr(self.model, attribute)
+            key = getattr(relation.property.mapper.class_, column)
+            found = {id: [] for id in ids}
+            query = (
+                m.db.session.query(pk, key)
+                .select_from(self.model)
+                .join(relation)
+                .filter(pk.in_(ids))
+                .order_by(pk, key)
+                .distinct()
+            )
+            for (id, value) in query:
+                found[id].append(value)
+            for item in items:
+                identity = inspect(item).identity_key
+                related_keys[(identity, attribute, column)] = found[getattr(item, primary_key)]
+        return related_keys
+
+    def _dump(self, schema, rows, keys):
+        # Dump `rows` with `schema` and add the translations selected for the fields `keys`.
+        #
+        # Keys of related items that are only dumped as keys or links are loaded for all
+        # items at once beforehand.
+        #
+        # :param obj schema     The :class:`~supermarket.schema.CustomSchema` instance to dump,
+        #                       excluding the fields `keys`.
+        # :param list rows      Query results, tuples of an item and its translations if `keys`
+        #                       isn’t empty. A single result if `schema` isn’t `many`.
+        # :param list keys      Keys of translated fields as returned by `_translated_fields`.
+        #
+        rows = rows if schema.many else [rows]
+        items = [row[0] for row in rows] if keys else rows
+        schema.context["related_keys"] = self._related_keys(schema, items)
+        data = schema.dump(items if schema.many else items[0]).data
+        if keys:
+            for item, row in zip(data if schema.many else [data], rows):
+                item.update(zip(keys, row[1:]))
+        return data
+
+    def _estimate_count(self, query, filtered):
+        # Estimate the number of items a query returns without counting them.
+        #
+        # Uses the table statistics for unfiltered queries and the query planner’s
+        # estimate otherwise (or if the table hasn’t been analyzed yet).
+        #
+        # :param obj query      Query of type :class:`~flask_sqlalchemy.BaseQuery` to estimate.
+        # :param bool filtered  Whether the query is filtered or joined with other tables.
+        #
+        if not filtered:
+            reltuples = m.db.session.execute(
+                text("SELECT reltuples FROM pg_class WHERE oid = CAST(:table AS regclass)"),
+                {"table": self.model.__tablename__},
+            ).scalar()
+            if reltuples is not None and reltuples > 0:
+                return int(reltuples)
+        plan = m.db.session.execute(Explain(query.order_by(None).statement)).scalar()
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    def _paginate(self, query, page, limit, count, filtered, context, columns=()):
+        # Get a :class:`~supermarket.api.Page` of items from the `query`.
+        #
+        # Adds any errors to the `context` and returns the page.
+        #
+        # :param obj query      Query of type :class:`~flask_sqlalchemy.BaseQuery` to page.
+        # :param int page       Number of the page (starting with 1).
+        # :param int limit      Maximum number of items per page.
+        # :param str count      How to get the total number of items: ‘exact’ counts all items,
+        #                       ‘estimate’ uses the estimate of the database and ‘none’ only
+        #                       checks whether there is a next page.
+        # :param bool filtered  Whether the query is filtered or joined with other tables.
+        # :param obj context    The :class:`~supermarket.api.QueryContext` of the request.
+        # :param list columns   Additional columns to select with each item (but not to count).
+        #
+        accepted_counts = ["exact", "estimate", "none"]
+        if count not in accepted_counts:
+            context.errors.append(
+                {
+                    "errors": [
+                        {
+                            "param": "count",
+                            "message": "Unknown value `{}`, try one of `{}`.".format(
+                                count, ", ".join(accepted_counts)
+                            ),
+                        }
+                    ],
+                    "message": "Some parameters have been ignored.",
+                }
+            )
+            count = "exact"
+        if page < 1 or limit < 0:
+            abort(404)
+
+        items = query.add_columns(*columns).limit(limit + 1).offset((page - 1) * limit).all()
+        if not items and page != 1:
+            abort(404)
+        more = len(items) > limit
+        items = items[:limit]
+
+        if count == "none":
+            total = None
+        elif page == 1 and not more:
+            total = len(items)
+        elif count == "estimate":
+            total = self._estimate_count(query, filtered)
+        else:
+            total = query.order_by(None).count()
+        return Page(query, page, limit, total, items, more, count)
+
     def _pagination_info(self, page):
-        # Get information from a :class:`~flask_sqlalchemy.Pagination` for later use as JSON.
+        # Get information from a :class:`~supermarket.api.Page` for later use as JSON.
         prev_url = (
             re.sub("page=\d+", "page={}".format(page.prev_num), request.url)
             if page.has_prev
@@ -254,7 +804,8 @@ class GenericResource:
             else:
                 next_url = "{}?page={}".format(request.url, page.next_num)
         pages = {
-            "total": page.pages,
+            "total": page.pages if page.pages is not None else False,
+            "count": page.count,
             "current": page.page,
             "next": page.next_num or False,
             "prev": page.prev_num or False,
@@ -263,12 +814,13 @@ class GenericResource:
         }
         return pages
 
-    def _parse_include_params(self, include_fields, errors):
+    def _parse_include_params(self, include_fields, context):
         # Go through `include_fields` (fields that should be nested) and retrieve their schema.
         #
         # :params str include_fields   The raw parameter value: a comma seperated list of fields
         #                              to nest, in the form <field>.<attr> or <field>.all
-        # :returns   A dictionary containing the schema and fields.
+        # :params obj context          The :class:`~supermarket.api.QueryContext` of the request.
+        # :returns   A dictionary mapping the field paths to the resource and fields.
         #
         include_raw = include_fields.split(",")
         include = MultiDict()
@@ -297,16 +849,15 @@ class GenericResource:
                         }
                     )
                 fields = ["all"]
-            # get attr of related field
+            # get the resource of the related field
             try:
-                # query isn’t needed, using dummy query to get at attr
-                attr = self._field_to_attr(relation, self.model.query)[0]
+                resource = self._resolve_field(relation)[3]
+                if resource is None:
+                    raise ParamException("`{}` can’t be included.".format(relation))
             except ParamException as e:
                 for f in fields:
                     not_included.append({"value": ".".join([relation, f]), "message": e.message})
                 continue
-            # find the matching resource
-            resource = next(filter(lambda v: v.model.__table__ == attr.table, resources.values()))
             # make sure all fields in `only` are valid and only ‘all’ becomes an empty list.
             only = []
             if fields != ["all"]:
@@ -327,27 +878,71 @@ class GenericResource:
             else:
                 only = None
             # everything seems fine, add field to `ìncluded`
-            included[relation.rpartition(".")[2]] = {"resource": resource, "only": only}
+            included[relation] = {"resource": resource, "only": only}
 
         if not_included:
-            errors.append(
+            context.errors.append(
                 {"errors": not_included, "message": "Some values have been not been included."}
             )
         return included
 
+    def _include(self, data, context):
+        # Replace the IDs of related items in the dumped `data` with the included items.
+        #
+        # The related items of each included field are collected from the whole page,
+        # loaded with a single query and dumped at once.
+        #
+        # :param list data      The dumped items.
+        # :param obj context    The :class:`~supermarket.api.QueryContext` of the request.
+        #
+        for path, v in context.include.items():
+            *parents, key = path.split(".")
+            nodes = data
+            for parent in parents:
+                nodes = _flatten(n.get(parent) for n in nodes)
+            nodes = [n for n in nodes if n.get(key)]
+            ids = set(_flatten(n[key] for n in nodes))
+            if not ids:
+                continue
+            resource = v["resource"]
+            schema = resource.schema(many=True, only=v["only"], lang=context.language)
+            primary_key = inspect(resource.model).primary_key[0].name
+            # Items already loaded for the page might lack relationships or columns needed here.
+            items = (
+                resource.model.query.options(*resource._load_options(schema))
+                .filter(getattr(resource.model, primary_key).in_(ids))
+                .populate_existing()
+                .all()
+            )
+            dumped = dict(
+                zip((getattr(i, primary_key) for i in items), resource._dump(schema, items, []))
+            )
+            for n in nodes:
+                if isinstance(n[key], list):
+                    n[key] = [dumped[id] for id in n[key] if id in dumped]
+                else:
+                    n[key] = dumped.get(n[key])
+
     def get_item(self, id):
         """Get an item of ‘type’ by ‘ID’."""
-        r = self.model.query.get_or_404(id)
-        errors = []
         args = request.args.copy()
-        only = self._sanitize_only(args.pop("only", None))
+        context = QueryContext(args.pop("lang", None), self._sanitize_only(args.pop("only", None)))
         include = args.pop("include", "")
-        self.language = args.pop("lang", None)
-        schema = self.schema(lang=self.language, only=only)
+        translated = self._translated_fields(context)
+        schema = self.schema(lang=context.language, only=context.only, exclude=translated)
+        query = self.model.query.options(*self._load_options(schema))
+        if translated:
+            primary_key = getattr(self.model, inspect(self.model).primary_key[0].name)
+            columns = self._translation_columns(translated, context)
+            r = query.add_columns(*columns).filter(primary_key == id).first_or_404()
+        else:
+            r = query.get_or_404(id)
+        data = self._dump(schema, r, translated)
         if include:
-            schema.context["include"] = self._parse_include_params(include, errors)
+            context.include = self._parse_include_params(include, context)
+            self._include([data], context)
 
-        return {"item": schema.dump(r).data, "errors": errors}, 200
+        return {"item": data, "errors": context.errors}, 200
 
     def patch_item(self, id):
         """Update an existing item with new data."""
@@ -385,9 +980,15 @@ class GenericResource:
         - lang: language for translated content (default 'en')
         - limit: maximum number of items per page (default 20)
         - page: which page to display (default 1)
+        - cursor: use keyset pagination, starting after the position returned as `next_cursor`
+                  (empty for the first page), instead of page numbers.
+        - count: how to get the total number of pages, one of 'exact' (default), 'estimate'
+                 (estimated by the database) or 'none' (not at all).
         - only: comma seperated field names to return in the result (includes all fields if empty).
         - sort: comma seperated field names to sort by, preceed by '-' to sort descending.
         - include: comma seperated nested field names prepended by field name that includes IDs.
+        - since: only get items changed since the sync token of an earlier response (empty
+                 for all items), the IDs of deleted items are listed in `deleted`.
         - <fieldname>: filter by the given value (using equal),
         - <fieldname>:<operator>: filter using the given operator,
                                   accepts 'lt', 'le', 'eq', 'ne', 'ge', 'gt', 'in' and 'like'
@@ -397,26 +998,89 @@ class GenericResource:
         args = request.args.copy()
         page = int(args.pop("page", 1))
         limit = int(args.pop("limit", 20))
+        cursor = args.pop("cursor", None)
+        count = args.pop("count", "exact")
         sort = args.pop("sort", None)
         include = args.pop("include", "")
-        self.language = args.pop("lang", None)
-        only = self._sanitize_only(args.pop("only", None))
-        errors = []
+        since = args.pop("since", None)
+        context = QueryContext(args.pop("lang", None), self._sanitize_only(args.pop("only", None)))
 
         # get data from model
-        query = self.model.query
-        query = self._sort(query, sort, errors)
-        query = self._filter(query, args, errors)
-        page = query.paginate(page=page, per_page=limit)
-        schema = self.schema(many=True, lang=self.language, only=only)
+        translated = self._translated_fields(context)
+        schema = self.schema(
+            many=True, lang=context.language, only=context.only, exclude=translated
+        )
+        columns = self._translation_columns(translated, context)
+        query = self.model.query.options(*self._load_options(schema))
+        (query, order) = self._sort(query, sort, context)
+        query = self._filter(query, args, context)
+        if since is not None:
+            (query, deleted, sync) = self._changed_since(query, since, context)
+        if cursor is not None:
+            key = "{}:{}".format(context.language or "", sort or "")
+            (items, pages) = self._cursor_page(query, order, cursor, limit, key, context, columns)
+        else:
+            filtered = bool(args) or bool(order) or since is not None
+            page = self._paginate(query, page, limit, count, filtered, context, columns)
+            (items, pages) = (page.items, self._pagination_info(page))
+        data = self._dump(schema, items, translated)
         if include:
-            schema.context["include"] = self._parse_include_params(include, errors)
+            context.include = self._parse_include_params(include, context)
+            self._include(data, context)
 
-        return {
-            "items": schema.dump(page.items).data,
-            "pages": self._pagination_info(page),
-            "errors": errors,
-        }, 200
+        result = {
+            "items": data,
+            "pages": pages,
+            "errors": context.errors,
+        }
+        if since is not None:
+            result.update({"deleted": deleted, "sync": sync})
+        return result, 200
+
+    def export_list(self, chunk_size=500):
+        """Stream all items of type ‘type’ as newline-delimited JSON.
+
+        Accepts the same ‘lang’, ‘only’, ‘include’, ‘sort’ and filter parameters as
+        `get_list`, but fails instead of ignoring invalid parameters. Items are read from
+        a server-side cursor and dumped in chunks of `chunk_size`, so memory use doesn’t
+        depend on the number of items and the first items are sent right away.
+
+        """
+        args = request.args.copy()
+        sort = args.pop("sort", None)
+        include = args.pop("include", "")
+        context = QueryContext(args.pop("lang", None), self._sanitize_only(args.pop("only", None)))
+
+        translated = self._translated_fields(context)
+        schema = self.schema(
+            many=True, lang=context.language, only=context.only, exclude=translated
+        )
+        columns = self._translation_columns(translated, context)
+        query = self.model.query.options(*self._load_options(schema))
+        (query, _) = self._sort(query, sort, context)
+        query = self._filter(query, args, context)
+        if include:
+            context.include = self._parse_include_params(include, context)
+        if context.errors:
+            errors = {}
+            for error in (e for group in context.errors for e in group["errors"]):
+                key = error.get("param", error.get("value"))
+                errors.setdefault(key, []).append(error["message"])
+            raise ValidationFailed(errors, "Invalid parameters.")
+        primary_key = getattr(self.model, inspect(self.model).primary_key[0].name)
+        query = query.add_columns(*columns).order_by(primary_key).yield_per(chunk_size)
+
+        def generate():
+            rows = iter(query)
+            chunk = list(islice(rows, chunk_size))
+            while chunk:
+                data = self._dump(schema, chunk, translated)
+                if context.include:
+                    self._include(data, context)
+                yield "".join(json.dumps(item) + "\n" for item in data)
+                chunk = list(islice(rows, chunk_size))
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
     def post_to_list(self):
         """Add a new item of type ‘type’."""
@@ -446,22 +1110,21 @@ class LabelResource(GenericResource):
             filter = super()._find_filter(field)
         return filter
 
-    def _hotspot_filter(self, query, field, op, value):
+    def _hotspot_filter(self, query, field, op, value, context):
         accepted_operators = ["eq", "in"]
         if op not in accepted_operators:
             raise FilterOperatorException(op, accepted_operators)
         hotspots = [v.strip() for v in value.split(",")]
         query = query.filter(
             self.model.id.in_(
-                m.db.session.query(m.LabelMeetsCriterion.label_id)
-                .join(m.LabelMeetsCriterion.criterion)
-                .join(m.Criterion.improves_hotspots)
-                .filter(m.CriterionImprovesHotspot.hotspot_id.in_(hotspots))
+                m.db.session.query(m.label_hotspots.c.label_id).filter(
+                    m.label_hotspots.c.hotspot_id.in_(hotspots)
+                )
             )
         )
         return query
 
-    def _country_filter(self, query, field, op, value):
+    def _country_filter(self, query, field, op, value, context):
         accepted_operators = ["eq", "in"]
         if op not in accepted_operators:
             raise FilterOperatorException(op, accepted_operators)
@@ -470,7 +1133,7 @@ class LabelResource(GenericResource):
         query = query.join(self.model.countries).filter(m.LabelCountry.code.in_(countries))
         return query
 
-    def _parse_include_params(self, include_fields, errors):
+    def _parse_include_params(self, include_fields, context):
         # include hotspots, too
         include_raw = include_fields.split(",")
         hotspot_fields = []
@@ -507,23 +1170,163 @@ class LabelResource(GenericResource):
             if not only:
                 only = None
 
-        included = super()._parse_include_params(",".join(super_fields), errors)
+        included = super()._parse_include_params(",".join(super_fields), context)
         if only is not None:
             included["hotspots"] = {"resource": resource, "only": only}
 
         if not_included:
             include_error = next(
-                (e for e in errors if e.message == "Some values have been not been included."), None
+                (
+                    e
+                    for e in context.errors
+                    if e.message == "Some values have been not been included."
+                ),
+                None,
             )
             if include_error:
                 include_error.errors.update(not_included)
             else:
-                errors.append(
+                context.errors.append(
                     {"errors": not_included, "message": "Some values have been not been included."}
                 )
         return included
 
 
+class ProductResource(GenericResource):
+
+    """Compares the scores per hotspot as numbers and recommends better products."""
+
+    def _field_to_attr(self, field, query, context):
+        (attr, query) = super()._field_to_attr(field, query, context)
+        (column, _, keys, _) = self._resolve_field(field)
+        if column is m.ProductScore.hotspots and keys:
+            attr = cast(attr, Float)
+        return (attr, query)
+
+    def export_csv(self):
+        """Stream all products as CSV in the format of the example data.
+
+        It's possible to choose the format with query parameters:
+        - sheet: which CSV file of the example data to produce, one of 'products' (default),
+                 'ingredients' or 'labels', see :mod:`supermarket.export`.
+        - lang: language for translated content (default 'en')
+
+        """
+        sheet = request.args.get("sheet", "products")
+        lang = request.args.get("lang", "en")
+        if sheet not in export.SHEETS:
+            message = "Unknown sheet, try one of `{}`.".format(", ".join(export.SHEETS))
+            raise ValidationFailed({"sheet": [message]}, "Invalid parameters.")
+        rows = export.product_rows(m.db.session, sheet, lang)
+        return Response(
+            stream_with_context(export.write_csv(rows)),
+            mimetype="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="products-{}.csv"'.format(sheet)},
+        )
+
+    def get_alternatives(self, id):
+        """Get products of the same category with a better overall score, best first.
+
+        It's possible to amend the list with query parameters:
+        - lang: language for translated content (default 'en')
+        - limit: maximum number of products (default 10)
+        - only: comma seperated field names to return in the result (includes all fields if empty).
+        - countries: comma seperated country codes, only products with a label used in one of
+                     these countries (or internationally) are returned.
+        - stores: comma seperated store IDs, only products sold in one of these stores are
+                  returned.
+
+        """
+        args = request.args.copy()
+        try:
+            limit = int(args.pop("limit", 10))
+        except ValueError:
+            raise ValidationFailed({"limit": ["Not a number."]}, "Invalid parameters.")
+        if limit < 0:
+            raise ValidationFailed({"limit": ["Must not be negative."]}, "Invalid parameters.")
+        countries = [v.strip() for v in args.pop("countries", "").split(",") if v.strip()]
+        stores = [v.strip() for v in args.pop("stores", "").split(",") if v.strip()]
+        context = QueryContext(args.pop("lang", None), self._sanitize_only(args.pop("only", None)))
+        # Every product has scores, only look for the product itself if they’re missing.
+        score = m.ProductScore.query.get(id)
+        if score is None:
+            exists = m.db.session.query(self.model.id).filter_by(id=id).exists()
+            if not m.db.session.query(exists).scalar():
+                abort(404)
+        if score is None or score.category_id is None:
+            return {"items": [], "errors": context.errors}, 200
+
+        translated = self._translated_fields(context)
+        schema = self.schema(
+            many=True, lang=context.language, only=context.only, exclude=translated
+        )
+        columns = self._translation_columns(translated, context)
+        # Served by the `ix_product_scores_category_overall` index.
+        query = (
+            self.model.query.options(*self._load_options(schema))
+            .join(m.ProductScore, m.ProductScore.product_id == self.model.id)
+            .filter(
+                m.ProductScore.category_id == score.category_id,
+                m.ProductScore.overall > score.overall,
+            )
+            .order_by(m.ProductScore.overall.desc(), m.ProductScore.product_id)
+        )
+        if countries:
+            labels = (
+                select([m.products_labels.c.product_id])
+                .select_from(
+                    m.products_labels.join(
+                        m.labels_countries,
+                        m.labels_countries.c.label_id == m.products_labels.c.label_id,
+                    )
+                )
+                .where(m.labels_countries.c.country_code.in_(countries + ["*"]))
+            )
+            query = query.filter(self.model.id.in_(labels))
+        if stores:
+            available = select([m.products_stores.c.product_id]).where(
+                m.products_stores.c.store_id.in_(stores)
+            )
+            query = query.filter(self.model.id.in_(available))
+        items = query.add_columns(*columns).limit(limit).all()
+        data = self._dump(schema, items, translated)
+
+        return {"items": data, "errors": context.errors}, 200
+
+
+def _flatten(values):
+    # Flatten `values` by one level, skipping empty values.
+    flat = []
+    for value in values:
+        if isinstance(value, list):
+            flat.extend(value)
+        elif value is not None:
+            flat.append(value)
+    return flat
+
+
+def _merge_tree(tree, other):
+    # Recursively merge the nested dict `other` into `tree`.
+    for key, subtree in other.items():
+        _merge_tree(tree.setdefault(key, {}), subtree)
+
+
+def _id_list(args, key):
+    # Get the IDs passed as `<key>=<id>` or `<key>:in=<id>,<id>,…` parameters.
+    #
+    # Raises a :class:`~supermarket.api.ValidationFailed` if there are no IDs or an ID
+    # isn’t a number.
+    #
+    values = args.getlist(key) + _flatten([v.split(",") for v in args.getlist(key + ":in")])
+    try:
+        ids = [int(v) for v in values if v.strip()]
+    except ValueError:
+        ids = []
+    if not ids:
+        raise ValidationFailed({key: ["A list of numeric IDs is required."]}, "Invalid parameters.")
+    return ids
+
+
 resources = {
     "brands": GenericResource(m.Brand, s.Brand),
     "categories": GenericResource(m.Category, s.Category),
@@ -532,13 +1335,88 @@ resources = {
     "labels": LabelResource(m.Label, s.Label),
     "origins": GenericResource(m.Origin, s.Origin),
     "producers": GenericResource(m.Producer, s.Producer),
-    "products": GenericResource(m.Product, s.Product),
+    "products": ProductResource(m.Product, s.Product),
     "resources": GenericResource(m.Resource, s.Resource),
     "retailers": GenericResource(m.Retailer, s.Retailer),
     "stores": GenericResource(m.Store, s.Store),
     "suppliers": GenericResource(m.Supplier, s.Supplier),
     "supplies": GenericResource(m.Supply, s.Supply),
 }
+resources_by_table = {r.model.__table__: r for r in resources.values()}
+
+
+def _table_versions(type):
+    # Get the versions of the tables of resource `type` and when they were last changed.
+    #
+    # Looked up once per request, so that the `ETag` and the cached response are always
+    # based on the same versions.
+    #
+    key = "supermarket.table_versions"
+    if key not in request.environ:
+        request.environ[key] = m.get_table_versions(m.db.session, resources[type].tables)
+    return request.environ[key]
+
+
+def cached(view):
+    """Serve the GET responses of a view from the response cache.
+
+    The view has to take the resource type as its first argument. Cached responses are
+    invalidated when one of the resource’s tables is written to, see :mod:`supermarket.cache`.
+
+    """
+
+    @wraps(view)
+    def wrapper(self, type, *args, **kwargs):
+        if not response_cache.enabled:
+            return view(self, type, *args, **kwargs)
+        (versions, _) = _table_versions(type)
+        (response, hit) = response_cache.get_or_set(
+            request.base_url,
+            request.args,
+            versions,
+            lambda: view(self, type, *args, **kwargs),
+        )
+        (data, status) = response
+        return data, status, {"X-Cache": "HIT" if hit else "MISS"}
+
+    return wrapper
+
+
+def conditional(view):
+    """Answer conditional GET requests of a view before it is run.
+
+    The view has to take the resource type as its first argument. The `ETag` and
+    `Last-Modified` headers are derived from the versions of the resource’s tables (see
+    :func:`supermarket.model.get_table_versions`), so checking them needs only a single
+    lookup. Requests with a matching `If-None-Match` (or, without it, `If-Modified-Since`)
+    get an empty ‘304 Not Modified’ response. As HTTP dates have no fractions of seconds,
+    `If-Modified-Since` only matches once the last change is in an earlier second.
+
+    """
+
+    @wraps(view)
+    def wrapper(self, type, *args, **kwargs):
+        (versions, updated) = _table_versions(type)
+        etag = response_cache.key(request.base_url, request.args, versions)
+        headers = {"ETag": quote_etag(etag)}
+        if updated is not None:
+            headers["Last-Modified"] = http_date(updated)
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            since = request.if_modified_since
+            if updated is not None and updated.microsecond:
+                # round up, a later change in the same second would have the same date
+                updated = updated.replace(microsecond=0) + timedelta(seconds=1)
+            not_modified = bool(since and updated) and updated <= since
+        if not_modified:
+            return "", 304, headers
+        (data, status, view_headers) = unpack(view(self, type, *args, **kwargs))
+        if status == 200:
+            view_headers.update(headers)
+        return data, status, view_headers
+
+    return wrapper
 
 
 @api.resource("/<any({}):type>/<int:id>".format(", ".join(resources)))
@@ -546,6 +1424,8 @@ class ResourceItem(BaseResource):
 
     """A resource item of type ‘type’, identified by its ID."""
 
+    @conditional
+    @cached
     def get(self, type, id):
         return resources[type].get_item(id)
 
@@ -567,6 +1447,8 @@ class ResourceList(BaseResource):
 
     """A list of resources of type ‘type’."""
 
+    @conditional
+    @cached
     def get(self, type):
         return resources[type].get_list()
 
@@ -575,6 +1457,33 @@ class ResourceList(BaseResource):
         return resources[type].post_to_list()
 
 
+@api.resource("/<any({}):type>/export".format(", ".join(resources)))
+class ResourceExport(BaseResource):
+
+    """All resources of type ‘type’ as newline-delimited JSON."""
+
+    def get(self, type):
+        return resources[type].export_list()
+
+
+@api.resource("/products/<int:id>/alternatives")
+class ProductAlternatives(BaseResource):
+
+    """Products of the same category as product ‘ID’ with a better score."""
+
+    def get(self, id):
+        return resources["products"].get_alternatives(id)
+
+
+@api.resource("/products/export.csv")
+class ProductCsvExport(BaseResource):
+
+    """All products as CSV in the format of the example data."""
+
+    def get(self):
+        return resources["products"].export_csv()
+
+
 @api.resource("/doc/<any({}):type>".format(", ".join(resources)))
 class ResourceDoc(BaseResource):
 
@@ -584,6 +1493,75 @@ class ResourceDoc(BaseResource):
         return resources[type].get_doc()
 
 
+@api.resource("/products/hotspot-profiles")
+class ProductHotspotProfiles(BaseResource):
+
+    """Hotspot risks of the products given by `id` or `id:in`, derived from their ingredients."""
+
+    def get(self):
+        ids = _id_list(request.args, "id")
+        found = m.db.session.query(m.Product.id).filter(m.Product.id.in_(ids))
+        found = set(row[0] for row in found)
+        profiles = hotspot_profiles(m.db.session, found) if found else {}
+        items = [{"id": id, "hotspots": profiles.get(id, {})} for id in ids if id in found]
+        errors = []
+        if len(found) < len(set(ids)):
+            errors.append(
+                {
+                    "errors": [
+                        {"param": "id", "message": "Unknown product IDs have been ignored."}
+                    ],
+                    "message": "Some parameters have been ignored.",
+                }
+            )
+        return {"items": items, "errors": errors}, 200
+
+
+@api.resource("/supplies/hotspot-profiles")
+class SupplyHotspotProfiles(BaseResource):
+
+    """Hotspot risk profile of the supplies given by `id` or `id:in`."""
+
+    def get(self):
+        ids = _id_list(request.args, "id")
+        profile = get_risk_matrix(m.db.session).profile(ids)
+        errors = []
+        if profile.pop("unknown"):
+            errors.append(
+                {
+                    "errors": [{"param": "id", "message": "Unknown supply IDs have been ignored."}],
+                    "message": "Some parameters have been ignored.",
+                }
+            )
+        return {
+            "items": profile["supplies"],
+            "hotspots": profile["hotspots"],
+            "errors": errors,
+        }, 200
+
+
+@api.resource("/resources/<int:id>/origins-by-risk")
+class ResourceOriginsByRisk(BaseResource):
+
+    """Origins of a resource ranked by their mean score for a `hotspot`, highest risk first."""
+
+    def get(self, id):
+        m.Resource.query.get_or_404(id)
+        errors = {}
+        try:
+            hotspot = int(request.args["hotspot"])
+        except (KeyError, ValueError):
+            errors["hotspot"] = ["A numeric hotspot ID is required."]
+        try:
+            limit = int(request.args.get("limit", 20))
+        except ValueError:
+            errors["limit"] = ["Not a number."]
+        if errors:
+            raise ValidationFailed(errors, "Invalid parameters.")
+        items = get_risk_matrix(m.db.session).origins_by_risk(id, hotspot, limit)
+        return {"items": items, "errors": []}, 200
+
+
 @api.resource("/".format(", ".join(resources)))
 class RootDoc(BaseResource):
 
@@ -1,10 +1,280 @@
+import hashlib
 import json
-import urllib
+import logging
+import os
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
 from functools import wraps
 
 from flask import _app_ctx_stack, current_app, request
 from jose import jwt
-from werkzeug.exceptions import BadRequest, Forbidden, Unauthorized
+from werkzeug.exceptions import BadRequest, Forbidden, ServiceUnavailable, Unauthorized
+
+logger = logging.getLogger(__name__)
+
+
+class JWKSCache(object):
+
+    """Process-wide cache for the JSON Web Key Set used to verify tokens.
+
+    The key set is fetched from ‘https://<AUTH0_DOMAIN>/.well-known/jwks.json’, or read from
+    `AUTH0_JWKS_FILE` if that is set (e.g. for tests), and kept for `AUTH0_JWKS_TTL` seconds.
+    A token signed with an unknown key ID forces a refresh. Attempts to load the key set are
+    at least `AUTH0_JWKS_MIN_REFRESH_INTERVAL` seconds apart.
+
+    After `AUTH0_JWKS_FAILURE_THRESHOLD` failed attempts in a row no further attempts are made
+    for `AUTH0_JWKS_RETRY_AFTER` seconds (the circuit breaker is open). As long as loading
+    fails, the last keys that could be loaded are used even if they are older than the TTL.
+
+    A background thread (see :meth:`start_refresher`) can load the keys before they expire,
+    so that requests don’t have to wait for it. It is started on first use in each process,
+    as threads don’t survive forking (e.g. into the workers of a pre-fork server).
+
+    """
+
+    def __init__(self):
+        self.reset_threads()
+        self.clear()
+        os.register_at_fork(after_in_child=self.reset_threads)
+
+    def reset_threads(self):
+        """Create new locks and forget the background thread, e.g. in a forked process."""
+        self.lock = threading.Lock()
+        self.fetch_lock = threading.Lock()
+        self.refresher = None
+        self.refresher_pid = None
+        self.stopped = threading.Event()
+
+    def clear(self):
+        """Forget all cached keys and reset the counters."""
+        with self.lock:
+            self.keys = {}
+            self.source = None
+            self.fetched_at = None
+            self.attempted_at = None
+            self.consecutive_failures = 0
+            self.open_until = None
+            self.counters = {
+                "refreshes": 0,
+                "failures": 0,
+                "last_latency": None,
+                "total_latency": 0.0,
+                "last_error": None,
+            }
+
+    @property
+    def stats(self):
+        """Get counters for the refresh latency (in seconds) and failures."""
+        with self.lock:
+            stats = dict(self.counters)
+            stats["consecutive_failures"] = self.consecutive_failures
+            stats["open"] = self.is_open(time.monotonic())
+        return stats
+
+    @staticmethod
+    def get_source(config):
+        """Get the URL or file path of the key set."""
+        if config["AUTH0_JWKS_FILE"]:
+            return config["AUTH0_JWKS_FILE"]
+        return "https://{}/.well-known/jwks.json".format(config["AUTH0_DOMAIN"])
+
+    @staticmethod
+    def fetch(source, timeout=None):
+        """Load a key set and map the RSA keys by their key ID."""
+        if source.startswith("https://"):
+            with urllib.request.urlopen(source, timeout=timeout) as response:
+                jwks = json.loads(response.read().decode())
+        else:
+            with open(source) as f:
+                jwks = json.load(f)
+        keys = {}
+        for key in jwks["keys"]:
+            keys[key["kid"]] = {
+                "kty": key["kty"],
+                "kid": key["kid"],
+                "use": key["use"],
+                "n": key["n"],
+                "e": key["e"],
+            }
+        return keys
+
+    def is_open(self, now):
+        """Check whether the circuit breaker currently prevents loading the key set."""
+        return self.open_until is not None and now < self.open_until
+
+    def needs_refresh(self, source, kid, config, now):
+        """Check whether the key set should be loaded (again) to get the key `kid`."""
+        if self.is_open(now):
+            return False
+        if self.attempted_at is not None:
+            if now - self.attempted_at < config["AUTH0_JWKS_MIN_REFRESH_INTERVAL"]:
+                return False
+        if source != self.source or self.fetched_at is None:
+            return True
+        return now - self.fetched_at >= config["AUTH0_JWKS_TTL"] or kid not in self.keys
+
+    def next_refresh_in(self, config, now):
+        """Get the number of seconds until the background thread should load the key set."""
+        if self.is_open(now):
+            return self.open_until - now
+        due = now
+        if self.fetched_at is not None:
+            due = self.fetched_at + config["AUTH0_JWKS_TTL"] - config["AUTH0_JWKS_REFRESH_AHEAD"]
+        if self.attempted_at is not None:
+            due = max(due, self.attempted_at + config["AUTH0_JWKS_MIN_REFRESH_INTERVAL"])
+        return max(due - now, 0)
+
+    def refresh(self, source, config):
+        """Replace the cached keys with a freshly loaded key set.
+
+        Returns `True` if the key set could be loaded. On failure the previous keys are kept.
+        """
+        with self.lock:
+            self.attempted_at = start = time.monotonic()
+        try:
+            keys = self.fetch(source, config["AUTH0_JWKS_TIMEOUT"])
+        except Exception as e:
+            logger.warning("Unable to load the JWKS from %s: %s", source, e)
+            with self.lock:
+                self.counters["failures"] += 1
+                self.counters["last_error"] = str(e)
+                self.consecutive_failures += 1
+                if self.consecutive_failures >= config["AUTH0_JWKS_FAILURE_THRESHOLD"]:
+                    self.open_until = time.monotonic() + config["AUTH0_JWKS_RETRY_AFTER"]
+            return False
+        with self.lock:
+            self.keys = keys
+            self.source = source
+            self.fetched_at = now = time.monotonic()
+            self.consecutive_failures = 0
+            self.open_until = None
+            self.counters["refreshes"] += 1
+            self.counters["last_latency"] = now - start
+            self.counters["total_latency"] += now - start
+        return True
+
+    def get_key(self, kid):
+        """Get the RSA key for a key ID, or `None` if there is no such key.
+
+        Raises :class:`~werkzeug.exceptions.ServiceUnavailable` if no keys could be loaded.
+
+        :param str kid      Key ID as found in the header of a token.
+        """
+        config = current_app.config
+        if config["AUTH0_JWKS_BACKGROUND_REFRESH"] and self.refresher_pid != os.getpid():
+            self.start_refresher(current_app)
+        source = self.get_source(config)
+        with self.lock:
+            needs_refresh = self.needs_refresh(source, kid, config, time.monotonic())
+        if needs_refresh:
+            with self.fetch_lock:
+                # The keys might have been loaded while waiting for the lock.
+                with self.lock:
+                    needs_refresh = self.needs_refresh(source, kid, config, time.monotonic())
+                if needs_refresh:
+                    self.refresh(source, config)
+        with self.lock:
+            if source != self.source:
+                raise ServiceUnavailable("Unable to load the keys to verify the token.")
+            return self.keys.get(kid)
+
+    def start_refresher(self, app):
+        """Start a background thread that loads the key set before it expires.
+
+        Does nothing if the thread is already running in this process.
+
+        """
+        with self.lock:
+            running = self.refresher is not None and self.refresher.is_alive()
+            if running and self.refresher_pid == os.getpid():
+                return
+            self.refresher_pid = os.getpid()
+            self.stopped.clear()
+            self.refresher = threading.Thread(
+                target=self.run_refresher,
+                args=(app.config,),
+                name="jwks-refresher",
+                daemon=True,
+            )
+            self.refresher.start()
+
+    def stop_refresher(self):
+        """Stop the background thread."""
+        self.stopped.set()
+        if self.refresher is not None:
+            self.refresher.join()
+            self.refresher = None
+            self.refresher_pid = None
+
+    def run_refresher(self, config):
+        source = self.get_source(config)
+        while True:
+            with self.lock:
+                delay = self.next_refresh_in(config, time.monotonic())
+            if self.stopped.wait(delay):
+                return
+            with self.fetch_lock:
+                with self.lock:
+                    if self.is_open(time.monotonic()):
+                        continue
+                self.refresh(source, config)
+
+
+class TokenCache(object):
+
+    """Process-wide LRU cache of already verified tokens.
+
+    Maps the SHA-256 digest of a token to its decoded payload and the set of its scopes.
+    Entries are only used until the token expires, and at most `AUTH0_TOKEN_CACHE_SIZE`
+    tokens are kept.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def clear(self):
+        """Forget all verified tokens."""
+        with self.lock:
+            self.entries.clear()
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token):
+        """Get payload and scopes of a verified token, or `None` if it is unknown or expired."""
+        key = self.digest(token)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            payload, scopes, expires = entry
+            if expires <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return payload, scopes
+
+    def set(self, token, payload, scopes):
+        """Remember payload and scopes of a verified token until it expires."""
+        expires = payload.get("exp")
+        size = current_app.config["AUTH0_TOKEN_CACHE_SIZE"]
+        if not isinstance(expires, (int, float)) or size <= 0:
+            return
+        key = self.digest(token)
+        with self.lock:
+            self.entries[key] = (payload, scopes, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+
+
+jwks_cache = JWKSCache()
+token_cache = TokenCache()
 
 
 class Auth0(object):
@@ -26,6 +296,19 @@ class Auth0(object):
         app.config.setdefault("AUTH0_API_AUDIENCE", "")
         app.config.setdefault("AUTH0_ALGORITHMS", ["RS256"])
         app.config.setdefault("AUTH0_ENABLE", app.config.get("TESTING", False))
+        app.config.setdefault("AUTH0_JWKS_FILE", None)
+        app.config.setdefault("AUTH0_JWKS_TTL", 3600)
+        app.config.setdefault("AUTH0_JWKS_MIN_REFRESH_INTERVAL", 30)
+        app.config.setdefault("AUTH0_JWKS_TIMEOUT", 5)
+        app.config.setdefault("AUTH0_JWKS_REFRESH_AHEAD", 300)
+        app.config.setdefault("AUTH0_JWKS_FAILURE_THRESHOLD", 3)
+        app.config.setdefault("AUTH0_JWKS_RETRY_AFTER", 60)
+        app.config.setdefault(
+            "AUTH0_JWKS_BACKGROUND_REFRESH",
+            app.config["AUTH0_ENABLE"] and not app.config.get("TESTING", False),
+        )
+        app.config.setdefault("AUTH0_TOKEN_CACHE_SIZE", 1024)
+        # The background refresh is started on first use, see `JWKSCache.get_key`.
 
     @property
     def enabled(self):
@@ -53,6 +336,44 @@ class Auth0(object):
         token = parts[1]
         return token
 
+    @staticmethod
+    def get_scopes(payload):
+        """Get the scopes of a token payload as a frozenset."""
+        return frozenset(payload.get("scope", "").split())
+
+    def verify_token(self, token):
+        """Verify the signature and claims of a token.
+
+        Returns the payload and the scopes of the token. Tokens that have been verified before
+        are taken from the token cache until they expire.
+        """
+        cached = token_cache.get(token)
+        if cached is not None:
+            return cached
+
+        unverified_header = jwt.get_unverified_header(token)
+        rsa_key = jwks_cache.get_key(unverified_header.get("kid"))
+        if not rsa_key:
+            raise BadRequest("Unable to find appropriate key.")
+        try:
+            payload = jwt.decode(
+                token,
+                rsa_key,
+                algorithms=current_app.config["AUTH0_ALGORITHMS"],
+                audience=current_app.config["AUTH0_API_AUDIENCE"],
+                issuer="https://{}/".format(current_app.config["AUTH0_DOMAIN"]),
+            )
+        except jwt.ExpiredSignatureError:
+            raise Unauthorized("Token is expired.")
+        except jwt.JWTClaimsError:
+            raise Unauthorized("Incorrect claims, please check the audience and issuer.")
+        except Exception:
+            raise BadRequest("Unable to parse authentication token.")
+
+        scopes = self.get_scopes(payload)
+        token_cache.set(token, payload, scopes)
+        return payload, scopes
+
     def requires_auth(self, f):
         """Determines if the access token is valid."""
 
@@ -62,40 +383,8 @@ class Auth0(object):
                 token = self.get_token_auth_header()
             elif self.enabled:
                 token = self.get_token_auth_header()
-                # get public key
-                jsonurl = urllib.request.urlopen(
-                    "https://{}/.well-known/jwks.json".format(current_app.config["AUTH0_DOMAIN"])
-                )
-                jwks = json.loads(jsonurl.read().decode())
-                unverified_header = jwt.get_unverified_header(token)
-                rsa_key = {}
-                for key in jwks["keys"]:
-                    if key["kid"] == unverified_header["kid"]:
-                        rsa_key = {
-                            "kty": key["kty"],
-                            "kid": key["kid"],
-                            "use": key["use"],
-                            "n": key["n"],
-                            "e": key["e"],
-                        }
-                if not rsa_key:
-                    raise BadRequest("Unable to find appropriate key.")
-                try:
-                    payload = jwt.decode(
-                        token,
-                        rsa_key,
-                        algorithms=current_app.config["AUTH0_ALGORITHMS"],
-                        audience=current_app.config["AUTH0_API_AUDIENCE"],
-                        issuer="https://{}/".format(current_app.config["AUTH0_DOMAIN"]),
-                    )
-                except jwt.ExpiredSignatureError:
-                    raise Unauthorized("Token is expired.")
-                except jwt.JWTClaimsError:
-                    raise Unauthorized("Incorrect claims, please check the audience and issuer.")
-                except Exception:
-                    raise BadRequest("Unable to parse authentication token.")
-
-                _app_ctx_stack.top.current_user = payload
+                ctx = _app_ctx_stack.top
+                ctx.current_user, ctx.current_scopes = self.verify_token(token)
 
             return f(*args, **kwargs)
 
@@ -108,13 +397,13 @@ class Auth0(object):
         """
         if not self.enabled:
             return True
-        token = self.get_token_auth_header()
-        unverified_claims = jwt.get_unverified_claims(token)
-        token_scopes = unverified_claims["scope"].split()
-        for token_scope in token_scopes:
-            if token_scope == required_scope:
-                return True
-        return False
+        ctx = _app_ctx_stack.top
+        scopes = getattr(ctx, "current_scopes", None)
+        if scopes is None:
+            # The token has not been verified (i.e. while testing), use its claims as they are.
+            unverified_claims = jwt.get_unverified_claims(self.get_token_auth_header())
+            scopes = ctx.current_scopes = self.get_scopes(unverified_claims)
+        return required_scope in scopes
 
     def requires_scope(self, required_scope):
         """Decorator to determine if the required scope is present in the access token."""
@@ -0,0 +1,161 @@
+"""Cache for GET responses that is invalidated by writes to the database.
+
+Cache keys contain the versions of all tables a response depends on, as kept in the
+`table_versions` table (see :func:`supermarket.model.get_table_versions`). A table’s version
+changes in the same transaction as its rows, so every process sees a write and the new
+versions at the same time, and a write makes all responses reading from the table
+unreachable at once. Outdated entries are never read again and are eventually evicted (or
+expire in the shared store).
+
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryBackend(object):
+
+    """Process-wide LRU cache of responses, keeping up to `size` responses."""
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        """Get a cached response or `None`."""
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Cache a response."""
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+class SharedBackend(object):
+
+    """Responses in a key-value store shared by all processes.
+
+    The `client` needs the `get` and `set` (with an `ex` timeout in seconds) methods of a
+    Redis client. :class:`LocalStore` can stand in for development and tests.
+
+    """
+
+    def __init__(self, client, ttl=3600, prefix="supermarket:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + "response:" + key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + "response:" + key, json.dumps(value), ex=self.ttl)
+
+
+class LocalStore(object):
+
+    """In-process stand-in for the Redis client used by :class:`SharedBackend`."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+
+    def get(self, key):
+        with self.lock:
+            (value, expires) = self.data.get(key, (None, None))
+            if expires is not None and expires <= time.monotonic():
+                del self.data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        with self.lock:
+            self.data[key] = (value, None if ex is None else time.monotonic() + ex)
+
+
+class ResponseCache(object):
+
+    """Cache GET responses until one of the tables they depend on is written to.
+
+    Configured by `RESPONSE_CACHE`: `None` (disabled, the default), ‘memory’
+    (:class:`MemoryBackend` with `RESPONSE_CACHE_SIZE` entries) or ‘shared’
+    (:class:`SharedBackend` using the client in `RESPONSE_CACHE_CLIENT` with entries expiring
+    after `RESPONSE_CACHE_TTL` seconds).
+
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("RESPONSE_CACHE", None)
+        app.config.setdefault("RESPONSE_CACHE_SIZE", 1024)
+        app.config.setdefault("RESPONSE_CACHE_CLIENT", None)
+        app.config.setdefault("RESPONSE_CACHE_TTL", 3600)
+        kind = app.config["RESPONSE_CACHE"]
+        if kind == "memory":
+            self.backend = MemoryBackend(app.config["RESPONSE_CACHE_SIZE"])
+        elif kind == "shared":
+            client = app.config["RESPONSE_CACHE_CLIENT"] or LocalStore()
+            self.backend = SharedBackend(client, app.config["RESPONSE_CACHE_TTL"])
+        else:
+            self.backend = None
+
+    @staticmethod
+    def key(url, args, versions):
+        """Build the cache key of a request.
+
+        :param str url          The URL of the request without query parameters.
+        :param obj args         The query parameters as :class:`~werkzeug.datastructures.MultiDict`.
+        :param list versions    The versions of the tables the response depends on.
+
+        """
+        params = sorted(args.items(multi=True))
+        data = json.dumps([url, params, versions], separators=(",", ":"))
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    @property
+    def enabled(self):
+        """Whether responses are cached at all."""
+        return self.backend is not None
+
+    def get_or_set(self, url, args, versions, build):
+        """Get the cached response data or build and cache it.
+
+        Returns a tuple of the response data and whether it was cached.
+
+        :param str url          The URL of the request without query parameters.
+        :param obj args         The query parameters as :class:`~werkzeug.datastructures.MultiDict`.
+        :param list versions    The versions of the tables the response depends on.
+        :param func build       Called without arguments to get the data and status code of
+                                the response. Only responses with status 200 are cached.
+
+        """
+        backend = self.backend
+        if backend is None:
+            return (build(), False)
+        key = self.key(url, args, versions)
+        data = backend.get(key)
+        if data is not None:
+            return ((data, 200), True)
+        (data, status) = build()
+        if status == 200:
+            backend.set(key, data)
+        return ((data, status), False)
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,206 @@
+"""Export products in the wide CSV formats of the example data.
+
+Each sheet has the columns of one of the CSV files in `fixtures/csvs`, so exports can be
+edited like the example data and imported the same way:
+
+- ‘products’: one row per product like `Data_1_Example_Product.csv`
+- ‘ingredients’: the ingredients of each product like `Data_2_Example_Ingredients.csv`
+- ‘labels’: the labels of each product like `Data_2_Example_Labels.csv`
+
+Products are read from a server-side cursor in chunks, loading the related items of each
+chunk at once, so memory use doesn’t depend on the number of products.
+
+"""
+
+import csv
+import io
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload, noload, selectinload
+
+from . import model as m
+
+PRODUCT_COLUMNS = [
+    "Product ID",
+    "Date of entry",
+    "Name or acronym of Researcher entering the data",
+    "Retailer",
+    "Supermarket",
+    "Product category",
+    "Frozen (yes/no)",
+    "Product type",
+    "Complete product Name",
+    "Store brand (Yes / No)",
+    "Brand",
+    "Name of Production Company (if stated)",
+    "Country of production (if stated)",
+    "Name of distribution Company (if stated)",
+    "Address of distribution Company (if stated)",
+    "Product Weight",
+    "g /l",
+    "Prize in Euro",
+    "Barcode Number (number below barcode)",
+    "Organic? (Yes/No)",
+    "Energy",
+    "kj / kcal",
+    "protein",
+    "carbohydrates",
+    "Sugar",
+    "Fett",
+    "saturated fat",
+    "Salt",
+    "Green claim? (Yes / No)",
+    "Description",
+    "Number Ingreadeants",
+    "Number Labels",
+    "Number pakaging material",
+]
+
+# columns shared by the ingredients and labels sheets
+PREFIX_COLUMNS = ["Product ID", "Retailer", "Product Name", "StoreBrand"]
+
+SHEETS = ("products", "ingredients", "labels")
+
+
+def _translate(value, lang):
+    # Get the translation of a translated value, or an empty string.
+    return (value or {}).get(lang) or ""
+
+
+def _products(session, chunk_size):
+    # Query all products with everything needed for the sheets, `chunk_size` at a time.
+    #
+    # Related items are loaded for each chunk at once and all other relationships are
+    # skipped (`yield_per` doesn’t work with the subquery loading some of them default to).
+    query = (
+        session.query(m.Product)
+        .options(
+            noload("*"),
+            joinedload(m.Product.brand).noload("*"),
+            joinedload(m.Product.brand).joinedload(m.Brand.retailer).noload("*"),
+            joinedload(m.Product.category).noload("*"),
+            joinedload(m.Product.producer).noload("*"),
+            selectinload(m.Product.stores).noload("*"),
+            selectinload(m.Product.labels).noload("*"),
+            selectinload(m.Product.ingredients).noload("*"),
+            selectinload(m.Product.ingredients).joinedload(m.Ingredient.origin).noload("*"),
+        )
+        .order_by(m.Product.id)
+    )
+    return query.yield_per(chunk_size)
+
+
+def _prefix(product, lang):
+    # Get the values of the `PREFIX_COLUMNS` for a product.
+    brand = product.brand
+    retailer = brand.retailer if brand else None
+    return [
+        product.id,
+        retailer.name if retailer else "",
+        _translate(product.name, lang),
+        "Yes" if retailer else "",
+    ]
+
+
+def _product_row(product, lang):
+    # Get the values of the `PRODUCT_COLUMNS` for a product.
+    #
+    # Columns without a counterpart in the model (like the date of entry, which isn’t
+    # `updated_at`) are left empty.
+    brand = product.brand
+    values = {
+        "Product ID": product.id,
+        "Retailer": brand.retailer.name if brand and brand.retailer else "",
+        "Supermarket": ", ".join(store.name for store in product.stores if store.name),
+        "Product category": product.category.name if product.category else "",
+        "Complete product Name": _translate(product.name, lang),
+        "Store brand (Yes / No)": "Yes" if brand and brand.retailer else "",
+        "Brand": brand.name if brand else "",
+        "Name of Production Company (if stated)": product.producer.name if product.producer else "",
+        "Barcode Number (number below barcode)": product.gtin or "",
+        "Description": _translate(product.details, lang),
+        "Number Ingreadeants": len(product.ingredients),
+        "Number Labels": len(product.labels),
+    }
+    return [values.get(column, "") for column in PRODUCT_COLUMNS]
+
+
+def _max_per_product(session, table):
+    # Get the largest number of rows in `table` belonging to a single product.
+    counts = (
+        select([func.count().label("count")])
+        .select_from(table)
+        .group_by(table.c.product_id)
+        .alias("counts")
+    )
+    return session.execute(select([func.max(counts.c.count)])).scalar() or 0
+
+
+def _pad(row, length):
+    # Fill up a row with empty values.
+    return row + [""] * (length - len(row))
+
+
+def product_rows(session, sheet="products", lang="en", chunk_size=500):
+    """Generate the rows of a sheet, starting with the header.
+
+    :param obj session      The session to use for the queries.
+    :param str sheet        One of the `SHEETS`.
+    :param str lang         Language of translated values.
+    :param int chunk_size   Number of products to load at once.
+
+    """
+    if sheet == "products":
+        yield PRODUCT_COLUMNS
+        for product in _products(session, chunk_size):
+            yield _product_row(product, lang)
+
+    elif sheet == "ingredients":
+        width = _max_per_product(session, m.Ingredient.__table__)
+        header = PREFIX_COLUMNS + [
+            c for i in range(width) for c in ("Ingredient {}".format(i + 1), "%", "origin")
+        ]
+        yield header
+        for product in _products(session, chunk_size):
+            row = _prefix(product, lang)
+            for ingredient in sorted(product.ingredients, key=lambda i: i.weight):
+                row.append(_translate(ingredient.name, lang))
+                percentage = ingredient.percentage
+                row.append("" if percentage is None else "{} %".format(percentage))
+                row.append(_translate(ingredient.origin.name, lang) if ingredient.origin else "")
+            yield _pad(row, len(header))
+
+    elif sheet == "labels":
+        width = _max_per_product(session, m.products_labels)
+        header = PREFIX_COLUMNS + ["Anzahl"]
+        header += [c for i in range(width) for c in ("Label {}".format(i + 1), "No")]
+        yield header
+        for product in _products(session, chunk_size):
+            row = _prefix(product, lang) + [len(product.labels)]
+            for label in sorted(product.labels, key=lambda label: label.id):
+                row += [_translate(label.name, lang), ""]
+            yield _pad(row, len(header))
+
+    else:
+        raise ValueError("Unknown sheet `{}`, try one of `{}`.".format(sheet, ", ".join(SHEETS)))
+
+
+def write_csv(rows, chunk_size=500):
+    """Format rows as CSV, yielding the text of up to `chunk_size` rows at a time.
+
+    The first row is yielded on its own so that the header is sent right away.
+
+    :param iter rows        The rows, lists of values.
+    :param int chunk_size   Number of rows to format at once.
+
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for i, row in enumerate(rows):
+        writer.writerow(row)
+        if i % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -1,7 +1,9 @@
 from marshmallow.exceptions import ValidationError
 from moflask.flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event, select
 from sqlalchemy.dialects.postgresql import JSONB
-from sqlalchemy.orm import validates
+from sqlalchemy.inspection import inspect
+from sqlalchemy.orm import Session, object_session, validates
 
 db = SQLAlchemy()
 
@@ -55,11 +57,45 @@ retailers_labels = db.Table(
     db.Column("label_id", db.Integer, db.ForeignKey("labels.id"), primary_key=True),
 )
 
+# derived from labels_criteria and criteria_hotspots, see `refresh_label_hotspots`
+label_hotspots = db.Table(
+    "label_hotspots",
+    db.Column(
+        "label_id", db.Integer, db.ForeignKey("labels.id", ondelete="CASCADE"), primary_key=True
+    ),
+    db.Column(
+        "hotspot_id",
+        db.Integer,
+        db.ForeignKey("hotspots.id", ondelete="CASCADE"),
+        primary_key=True,
+        index=True,
+    ),
+)
+
 
 # main tables
 
 
-class Brand(db.Model):
+class Timestamped(object):
+
+    """Mixin for models that keep track of when their rows were last changed.
+
+    Uses the time of the change rather than the start of the transaction, see `sync_time`.
+    Deleted rows are recorded in the `tombstones` table.
+
+    """
+
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        nullable=False,
+        default=db.func.clock_timestamp(),
+        server_default=db.func.clock_timestamp(),
+        onupdate=db.func.clock_timestamp(),
+        index=True,
+    )
+
+
+class Brand(Timestamped, db.Model):
 
     """The brand of a product.
 
@@ -79,7 +115,7 @@ class Brand(db.Model):
     # retailer – backref from Retailer
 
 
-class Category(db.Model):
+class Category(Timestamped, db.Model):
 
     """A category a product belongs to.
 
@@ -93,7 +129,7 @@ class Category(db.Model):
     products = db.relationship("Product", backref="category", lazy=True)
 
 
-class Criterion(db.Model):
+class Criterion(Timestamped, db.Model):
 
     """A criterion a label or a retailer policy can fulfill.
 
@@ -118,7 +154,7 @@ class Criterion(db.Model):
         return Translation.validate_translation(key, value)
 
 
-class CriterionCategory(db.Model):
+class CriterionCategory(Timestamped, db.Model):
 
     """Category for criteria.
 
@@ -144,7 +180,7 @@ class CriterionCategory(db.Model):
         return Translation.validate_translation(key, value)
 
 
-class CriterionImprovesHotspot(db.Model):
+class CriterionImprovesHotspot(Timestamped, db.Model):
 
     """Maps criteria to hotspots.
 
@@ -165,7 +201,7 @@ class CriterionImprovesHotspot(db.Model):
         return Translation.validate_translation(key, value)
 
 
-class Hotspot(db.Model):
+class Hotspot(Timestamped, db.Model):
 
     """A hotspot or issue is an area of concern (e.g. Climate Risk)."""
 
@@ -180,7 +216,7 @@ class Hotspot(db.Model):
         return Translation.validate_translation(key, value)
 
 
-class Ingredient(db.Model):
+class Ingredient(Timestamped, db.Model):
 
     """An ingredient of a product.
 
@@ -211,7 +247,7 @@ class Ingredient(db.Model):
         return Translation.validate_translation(key, value)
 
 
-class Label(db.Model):
+class Label(Timestamped, db.Model):
 
     """A label ensures that a product or retailer fulfills certain criteria.
 
@@ -241,6 +277,9 @@ class Label(db.Model):
         lazy="subquery",
         backref=db.backref("labels", lazy=True),
     )
+    hotspots = db.relationship(
+        "Hotspot", secondary=label_hotspots, viewonly=True, order_by="Hotspot.id", lazy=True
+    )
     # products – backref from Product
     # retailers – backref from Retailer
 
@@ -251,7 +290,7 @@ class Label(db.Model):
         return Translation.validate_translation(key, value)
 
 
-class LabelCountry(db.Model):
+class LabelCountry(Timestamped, db.Model):
 
     """Country where a label is in use, represented by its 2 letter ISO code."""
 
@@ -260,7 +299,7 @@ class LabelCountry(db.Model):
     # labels – backref from Label
 
 
-class LabelMeetsCriterion(db.Model):
+class LabelMeetsCriterion(Timestamped, db.Model):
 
     """Maps labels to their criteria.
 
@@ -282,7 +321,7 @@ class LabelMeetsCriterion(db.Model):
         return Translation.validate_translation(key, value)
 
 
-class Origin(db.Model):
+class Origin(Timestamped, db.Model):
 
     """The origin of a resource (a country or a FAO Major Fishing Area)."""
 
@@ -300,7 +339,7 @@ class Origin(db.Model):
         return Translation.validate_translation(key, value)
 
 
-class Producer(db.Model):
+class Producer(Timestamped, db.Model):
 
     """A producer producing certain products."""
 
@@ -310,7 +349,7 @@ class Producer(db.Model):
     products = db.relationship("Product", backref="producer", lazy=True)
 
 
-class Product(db.Model):
+class Product(Timestamped, db.Model):
 
     """Represents a product.
 
@@ -340,6 +379,7 @@ class Product(db.Model):
         lazy="subquery",
         backref=db.backref("products", lazy=True),
     )
+    scores = db.relationship("ProductScore", uselist=False, viewonly=True, lazy=True)
     # brand – backref from Brand
     # category – backref from Category
     # ingredients – backref from Ingredient
@@ -350,7 +390,31 @@ class Product(db.Model):
         return Translation.validate_translation(key, value)
 
 
-class Resource(db.Model):
+class ProductScore(Timestamped, db.Model):
+
+    """Precomputed sustainability scores of a product.
+
+    Derived from the product’s labels and ingredients, see :mod:`supermarket.scoring`.
+
+    """
+
+    __tablename__ = "product_scores"
+    product_id = db.Column(db.ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    category_id = db.Column(db.ForeignKey("categories.id"))  # copied from the product
+    overall = db.Column(db.Float, nullable=False, default=0, index=True)
+    hotspots = db.Column(JSONB, nullable=False, default=dict)  # scores per hotspot ID
+
+
+# products of a category ordered by their score, see `/products/<id>/alternatives`
+db.Index(
+    "ix_product_scores_category_overall",
+    ProductScore.category_id,
+    ProductScore.overall.desc(),
+    ProductScore.product_id,
+)
+
+
+class Resource(Timestamped, db.Model):
 
     """A resource (“Rohstoff”), independent of its origin or use in products."""
 
@@ -368,7 +432,7 @@ class Resource(db.Model):
         return Translation.validate_translation(key, value)
 
 
-class Retailer(db.Model):
+class Retailer(Timestamped, db.Model):
 
     """Represents a retailer.
 
@@ -392,7 +456,7 @@ class Retailer(db.Model):
     )
 
 
-class RetailerMeetsCriterion(db.Model):
+class RetailerMeetsCriterion(Timestamped, db.Model):
 
     """Maps retailer policies to their criteria.
 
@@ -409,7 +473,7 @@ class RetailerMeetsCriterion(db.Model):
     criterion = db.relationship("Criterion", lazy=True)
 
 
-class Score(db.Model):
+class Score(Timestamped, db.Model):
 
     """Maps the influence that a supply has on a hotspot area."""
 
@@ -428,7 +492,7 @@ class Score(db.Model):
         return Translation.validate_translation(key, value)
 
 
-class Store(db.Model):
+class Store(Timestamped, db.Model):
 
     """A store belonging to a certain retailer."""
 
@@ -441,7 +505,7 @@ class Store(db.Model):
     # retailer – backref from Retailer
 
 
-class Supplier(db.Model):
+class Supplier(Timestamped, db.Model):
 
     """A supplier of a resource."""
 
@@ -452,7 +516,7 @@ class Supplier(db.Model):
     # supplies – backref from Supply
 
 
-class Supply(db.Model):
+class Supply(Timestamped, db.Model):
 
     """A resource coming from an origin or supplier."""
 
@@ -465,3 +529,233 @@ class Supply(db.Model):
     origin = db.relationship("Origin", lazy=True, backref=db.backref("supplies", lazy=True))
     supplier = db.relationship("Supplier", lazy=True, backref=db.backref("supplies", lazy=True))
     # scores – backref from Score
+
+
+# label → hotspot index
+
+
+def refresh_label_hotspots(session, label_ids=None):
+    """Rebuild the `label_hotspots` table from the criteria the labels meet.
+
+    :param obj session      The session to use for the update.
+    :param set label_ids    Only update the hotspots of these labels (default: all labels).
+
+    """
+    delete = label_hotspots.delete()
+    query = (
+        select([LabelMeetsCriterion.label_id, CriterionImprovesHotspot.hotspot_id])
+        .select_from(
+            LabelMeetsCriterion.__table__.join(
+                CriterionImprovesHotspot.__table__,
+                LabelMeetsCriterion.criterion_id == CriterionImprovesHotspot.criterion_id,
+            )
+        )
+        .distinct()
+    )
+    if label_ids is not None:
+        delete = delete.where(label_hotspots.c.label_id.in_(label_ids))
+        query = query.where(LabelMeetsCriterion.label_id.in_(label_ids))
+    session.execute(delete)
+    session.execute(label_hotspots.insert().from_select(["label_id", "hotspot_id"], query))
+
+
+def _changed_ids(session):
+    # Get the sets of label and criterion IDs whose hotspots changed in the current flush.
+    return session.info.setdefault("label_hotspots_changed", (set(), set()))
+
+
+@event.listens_for(LabelMeetsCriterion, "after_insert")
+@event.listens_for(LabelMeetsCriterion, "after_update")
+@event.listens_for(LabelMeetsCriterion, "after_delete")
+def _label_criteria_changed(mapper, connection, target):
+    label_ids = _changed_ids(object_session(target))[0]
+    label_ids |= set(v for v in inspect(target).attrs.label_id.history.sum() if v is not None)
+
+
+@event.listens_for(CriterionImprovesHotspot, "after_insert")
+@event.listens_for(CriterionImprovesHotspot, "after_update")
+@event.listens_for(CriterionImprovesHotspot, "after_delete")
+def _criterion_hotspots_changed(mapper, connection, target):
+    criterion_ids = _changed_ids(object_session(target))[1]
+    criterion_ids |= set(
+        v for v in inspect(target).attrs.criterion_id.history.sum() if v is not None
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _update_label_hotspots(session, flush_context):
+    # Update the hotspots of labels whose criteria or whose criteria’s hotspots changed.
+    (label_ids, criterion_ids) = session.info.pop("label_hotspots_changed", (set(), set()))
+    if criterion_ids:
+        query = select([LabelMeetsCriterion.label_id]).where(
+            LabelMeetsCriterion.criterion_id.in_(criterion_ids)
+        )
+        label_ids |= set(row[0] for row in session.execute(query))
+    if label_ids:
+        refresh_label_hotspots(session, label_ids)
+
+
+# table versions
+
+# Incremented by triggers with every statement that changes rows of a table, so that clients can
+# cheaply find out whether anything changed, see `get_table_versions`. Statements that don’t
+# change any rows are skipped.
+#
+# Each table has a single version row, which a writing transaction keeps locked until it
+# commits. So concurrent transactions writing to the same table wait for each other. That’s
+# fine for the occasional editing this API sees, but bulk writers should commit in batches.
+table_versions = db.Table(
+    "table_versions",
+    db.Column("name", db.String, primary_key=True),
+    db.Column("version", db.BigInteger, nullable=False),
+    db.Column("updated_at", db.DateTime(timezone=True), nullable=False),
+)
+
+_bump_table_version = DDL(
+    """
+    CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP <> 'TRUNCATE' THEN
+            IF NOT EXISTS (SELECT 1 FROM changed_rows) THEN
+                RETURN NULL;
+            END IF;
+        END IF;
+        INSERT INTO table_versions (name, version, updated_at)
+        VALUES (TG_TABLE_NAME, 1, clock_timestamp())
+        ON CONFLICT (name) DO UPDATE
+        SET version = table_versions.version + 1,
+            updated_at = greatest(table_versions.updated_at, clock_timestamp());
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """
+)
+
+# (event, transition table) of the version triggers
+_version_triggers = [
+    ("INSERT", "REFERENCING NEW TABLE AS changed_rows"),
+    ("UPDATE", "REFERENCING NEW TABLE AS changed_rows"),
+    ("DELETE", "REFERENCING OLD TABLE AS changed_rows"),
+    ("TRUNCATE", ""),
+]
+
+_version_trigger = """
+    CREATE TRIGGER {0}_version_{1} AFTER {2} ON {0} {3}
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version()
+"""
+
+
+@event.listens_for(db.metadata, "after_create")
+def _create_version_triggers(target, connection, tables=(), **kw):
+    # Install the version trigger on all newly created tables.
+    connection.execute(_bump_table_version)
+    for table in tables:
+        if table is not table_versions:
+            for (op, referencing) in _version_triggers:
+                trigger = _version_trigger.format(table.name, op.lower(), op, referencing)
+                connection.execute(DDL(trigger))
+
+
+def get_table_versions(session, tables):
+    """Get the current versions of tables and when the last one of them was changed.
+
+    Returns a tuple of the versions in the order of `tables` (0 for tables that haven’t been
+    written to yet) and the time of the last change (`None` if there was none).
+
+    :param obj session      The session to use for the query.
+    :param list tables      Names of the tables.
+
+    """
+    query = select([table_versions]).where(table_versions.c.name.in_(tables))
+    rows = {row.name: row for row in session.execute(query)}
+    versions = [rows[name].version if name in rows else 0 for name in tables]
+    updated = max((row.updated_at for row in rows.values()), default=None)
+    return (versions, updated)
+
+
+# change tracking
+
+# deleted rows of `Timestamped` models, see `_record_tombstone`
+tombstones = db.Table(
+    "tombstones",
+    db.Column("id", db.BigInteger, primary_key=True),
+    db.Column("table_name", db.String, nullable=False),
+    db.Column("identity", JSONB, nullable=False),  # primary key values of the deleted row
+    db.Column(
+        "deleted_at",
+        db.DateTime(timezone=True),
+        nullable=False,
+        server_default=db.func.clock_timestamp(),
+    ),
+    db.Index("ix_tombstones_table_name_deleted_at", "table_name", "deleted_at"),
+)
+
+
+@event.listens_for(Timestamped, "after_delete", propagate=True)
+def _record_tombstone(mapper, connection, target):
+    identity = list(mapper.primary_key_from_instance(target))
+    connection.execute(
+        tombstones.insert().values(table_name=mapper.local_table.name, identity=identity)
+    )
+
+
+@event.listens_for(Session, "before_flush")
+def _touch_changed(session, flush_context, instances):
+    # Update the timestamp of rows whose related collections changed, too.
+    for obj in session.dirty:
+        if isinstance(obj, Timestamped) and session.is_modified(obj):
+            obj.updated_at = db.func.clock_timestamp()
+
+
+def sync_time(session):
+    """Get the time from which on all changes not yet visible to the session will be recorded.
+
+    Changes are timestamped when they are made, but only become visible once their transaction
+    is committed. So the time is the current time, or the start of the oldest transaction that
+    has written something but hasn’t been committed yet. Changes with a timestamp before it are
+    visible to statements run afterwards.
+
+    Only transactions of the database user itself (or visible to it) are taken into account.
+
+    :param obj session      The session to use for the query.
+
+    """
+    pending = select([db.func.min(db.column("xact_start"))]).select_from(
+        db.table("pg_stat_activity", db.column("xact_start"), db.column("backend_xid"))
+    )
+    pending = pending.where(db.column("backend_xid").isnot(None))
+    return session.execute(
+        select([db.func.least(db.func.clock_timestamp(), pending.as_scalar())])
+    ).scalar()
+
+
+def deleted_since(session, table_name, time):
+    """Get the primary key values of the rows of a table that were deleted since `time`.
+
+    :param obj session      The session to use for the query.
+    :param str table_name   The name of the table.
+    :param obj time         Timestamp as returned by `sync_time`.
+
+    """
+    query = (
+        select([tombstones.c.identity])
+        .where(tombstones.c.table_name == table_name)
+        .where(tombstones.c.deleted_at >= time)
+        .order_by(tombstones.c.id)
+    )
+    return [row.identity for row in session.execute(query)]
+
+
+def prune_tombstones(session, before):
+    """Delete the records of rows that were deleted before `before`.
+
+    Changes since an earlier time can’t be told completely any more afterwards, so sync tokens
+    from before then have to be rejected.
+
+    Returns the number of deleted records.
+
+    :param obj session      The session to use for the query.
+    :param obj before       Timestamp of the oldest records to keep.
+
+    """
+    return session.execute(tombstones.delete().where(tombstones.c.deleted_at < before)).rowcount
@@ -0,0 +1,223 @@
+"""In-process matrix of supply risks.
+
+The `scores` table maps supplies and hotspots to a score, so it is a sparse matrix. It is
+loaded into a dense NumPy array (supplies × hotspots, `nan` where there is no score) with
+indexes of the supplies by resource and origin, so that questions spanning many supplies are
+answered with vectorized reductions instead of row by row.
+
+The matrix is rebuilt on first use after any scores or supplies changed in the database, see
+:func:`get_risk_matrix`.
+
+"""
+
+import threading
+
+import numpy as np
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, object_session
+
+from . import model as m
+
+
+class RiskMatrix:
+
+    """Scores of supplies for hotspots.
+
+    Attributes:
+        supply_ids      Sorted array of the supply IDs, one per row.
+        hotspot_ids     Sorted array of the hotspot IDs, one per column.
+        resource_ids    Array of the resource ID of each row (-1 if unknown).
+        origin_ids      Array of the origin ID of each row (-1 if unknown).
+        scores          Float array of shape (supplies, hotspots), `nan` for missing scores.
+        by_resource     Dict mapping resource IDs to arrays of their rows.
+        by_origin       Dict mapping origin IDs to arrays of their rows.
+
+    """
+
+    def __init__(self, supplies, scores):
+        """Build the matrix.
+
+        :param list supplies    (supply ID, resource ID, origin ID) tuples.
+        :param list scores      (supply ID, hotspot ID, score) tuples.
+
+        """
+        supplies = np.array(
+            [(id, -1 if r is None else r, -1 if o is None else o) for (id, r, o) in supplies],
+            dtype=np.int64,
+        ).reshape(-1, 3)
+        supplies = supplies[np.argsort(supplies[:, 0])]
+        scores = np.array(scores, dtype=np.float64).reshape(-1, 3)
+
+        self.supply_ids = supplies[:, 0]
+        self.resource_ids = supplies[:, 1]
+        self.origin_ids = supplies[:, 2]
+        self.hotspot_ids = np.unique(scores[:, 1].astype(np.int64))
+        self.scores = np.full((len(self.supply_ids), len(self.hotspot_ids)), np.nan)
+        rows = np.searchsorted(self.supply_ids, scores[:, 0].astype(np.int64))
+        columns = np.searchsorted(self.hotspot_ids, scores[:, 1].astype(np.int64))
+        self.scores[rows, columns] = scores[:, 2]
+        self.by_resource = _index(self.resource_ids)
+        self.by_origin = _index(self.origin_ids)
+
+    @classmethod
+    def load(cls, session):
+        """Build the matrix from the `supplies` and `scores` tables.
+
+        :param obj session      The session to query.
+
+        """
+        supplies = session.execute(
+            select([m.Supply.id, m.Supply.resource_id, m.Supply.origin_id])
+        ).fetchall()
+        scores = session.execute(
+            select([m.Score.supply_id, m.Score.hotspot_id, m.Score.score])
+        ).fetchall()
+        return cls(supplies, scores)
+
+    def rows(self, supply_ids):
+        """Get the rows of supplies.
+
+        Returns an array of rows and an array of the supply IDs that are not in the matrix.
+
+        :param list supply_ids  The IDs of the supplies.
+
+        """
+        supply_ids = np.asarray(supply_ids, dtype=np.int64)
+        rows = np.searchsorted(self.supply_ids, supply_ids)
+        found = rows < len(self.supply_ids)
+        found[found] = self.supply_ids[rows[found]] == supply_ids[found]
+        return (rows[found], supply_ids[~found])
+
+    def column(self, hotspot_id):
+        """Get the column of a hotspot or `None` if there are no scores for it."""
+        column = np.searchsorted(self.hotspot_ids, hotspot_id)
+        if column < len(self.hotspot_ids) and self.hotspot_ids[column] == hotspot_id:
+            return column
+        return None
+
+    def profile(self, supply_ids):
+        """Get the hotspot risk profile of supplies.
+
+        Returns a dict with a list of the supplies’ IDs and scores per hotspot (`supplies`),
+        the mean and maximum score of the supplies per hotspot (`hotspots`) and the IDs of the
+        supplies that weren’t found (`unknown`).
+
+        :param list supply_ids  The IDs of the supplies.
+
+        """
+        (rows, unknown) = self.rows(supply_ids)
+        scores = self.scores[rows]
+        scored = ~np.isnan(scores)
+        counts = scored.sum(axis=0)
+        totals = np.where(scored, scores, 0).sum(axis=0)
+        maxima = np.where(scored, scores, -np.inf).max(axis=0, initial=-np.inf)
+        hotspots = {}
+        for column in np.flatnonzero(counts):
+            hotspots[int(self.hotspot_ids[column])] = {
+                "mean": float(totals[column] / counts[column]),
+                "max": float(maxima[column]),
+                "supplies": int(counts[column]),
+            }
+        supplies = [
+            {
+                "id": int(self.supply_ids[row]),
+                "hotspots": {
+                    int(h): float(v)
+                    for (h, v) in zip(self.hotspot_ids[row_scored], row_scores[row_scored])
+                },
+            }
+            for (row, row_scores, row_scored) in zip(rows, scores, scored)
+        ]
+        return {"supplies": supplies, "hotspots": hotspots, "unknown": unknown.tolist()}
+
+    def origins_by_risk(self, resource_id, hotspot_id, limit=None):
+        """Rank the origins of a resource by their mean score for a hotspot.
+
+        Returns a list of dicts with the origin ID, its mean score and the number of scored
+        supplies, highest risk first. Supplies without an origin or score are left out.
+
+        :param int resource_id  The ID of the resource.
+        :param int hotspot_id   The ID of the hotspot.
+        :param int limit        Maximum number of origins to return (default: all).
+
+        """
+        column = self.column(hotspot_id)
+        rows = self.by_resource.get(resource_id)
+        if column is None or rows is None:
+            return []
+        rows = rows[self.origin_ids[rows] >= 0]
+        scores = self.scores[rows, column]
+        scored = ~np.isnan(scores)
+        (origins, groups) = np.unique(self.origin_ids[rows][scored], return_inverse=True)
+        counts = np.bincount(groups, minlength=len(origins))
+        means = np.bincount(groups, weights=scores[scored], minlength=len(origins)) / counts
+        order = np.lexsort((origins, -means))[:limit]
+        return [
+            {"origin": int(origins[i]), "risk": float(means[i]), "supplies": int(counts[i])}
+            for i in order
+        ]
+
+
+def _index(values):
+    # Map each distinct value (except -1) to the array of rows containing it.
+    order = np.argsort(values, kind="stable")
+    (keys, starts) = np.unique(values[order], return_index=True)
+    return {int(key): rows for (key, rows) in zip(keys, np.split(order, starts[1:])) if key >= 0}
+
+
+# cache
+
+_lock = threading.Lock()
+_matrix = None  # (matrix, versions of the tables it was loaded from)
+_tables = ["scores", "supplies"]
+
+
+def get_risk_matrix(session):
+    """Get the current risk matrix, (re)building it if scores or supplies changed.
+
+    Changes are detected by the versions of the tables in the database, so writes from
+    other processes or bypassing the ORM are noticed as well. The matrix is loaded outside
+    the lock and isn’t cached while the session has uncommitted changes of its own.
+
+    :param obj session      The session to use for loading the matrix.
+
+    """
+    global _matrix
+    (versions, _) = m.get_table_versions(session, _tables)
+    with _lock:
+        (matrix, loaded) = _matrix or (None, None)
+    if loaded == versions:
+        return matrix
+
+    matrix = RiskMatrix.load(session)
+    if not session.info.get("risk_matrix_changed"):
+        with _lock:
+            # Don’t replace a matrix another thread loaded from newer versions.
+            newer = _matrix and all(a >= b for (a, b) in zip(_matrix[1], versions))
+            if not newer:
+                _matrix = (matrix, versions)
+    return matrix
+
+
+def invalidate_risk_matrix():
+    """Make the next :func:`get_risk_matrix` rebuild the matrix."""
+    global _matrix
+    with _lock:
+        _matrix = None
+
+
+@event.listens_for(m.Score, "after_insert")
+@event.listens_for(m.Score, "after_update")
+@event.listens_for(m.Score, "after_delete")
+@event.listens_for(m.Supply, "after_insert")
+@event.listens_for(m.Supply, "after_update")
+@event.listens_for(m.Supply, "after_delete")
+def _risks_changed(mapper, connection, target):
+    # Uncommitted changes mustn’t end up in the shared matrix.
+    object_session(target).info["risk_matrix_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_soft_rollback")
+def _risk_changes_done(session, *args):
+    session.info.pop("risk_matrix_changed", None)
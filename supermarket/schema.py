@@ -1,7 +1,9 @@
+from functools import lru_cache
+
 import pycountry
-from flask import url_for
+from flask import has_request_context, request, url_for
 from flask_marshmallow import Marshmallow
-from flask_marshmallow.fields import _rapply as ma_rapply
+from flask_marshmallow.fields import _rapply as ma_rapply, _tpl as ma_tpl
 from marshmallow import (
     ValidationError,
     class_registry,
@@ -11,14 +13,129 @@ from marshmallow import (
     utils,
     validates_schema,
 )
-from marshmallow_sqlalchemy import fields as masqla_fields
+from marshmallow_sqlalchemy import ModelConverter as BaseModelConverter, fields as masqla_fields
 from sqlalchemy.inspection import inspect
+from sqlalchemy.orm.interfaces import ONETOMANY
+from werkzeug.urls import url_quote_plus
 
 import supermarket.model as m
 
 ma = Marshmallow()
 
 
+# URL templates
+
+# Stands in for the varying value when building a template, digits pass through URL converters
+# and quoting unchanged.
+_URL_PLACEHOLDER = 918273645546372819
+
+
+@lru_cache(maxsize=1024)
+def _url_template(url_root, endpoint, values):
+    # Build a URL with a placeholder and split it where the placeholder is.
+    #
+    # Returns the URL parts before and after the placeholder and whether the placeholder
+    # is part of the query string, or `None` if the URL can’t be used as a template.
+    #
+    # :param str url_root   Root URL of the current request, templates are built per host.
+    # :param str endpoint   Flask endpoint name.
+    # :param tuple values   The (name, value) pairs to build the URL with.
+    #
+    url = url_for(endpoint, **dict(values))
+    parts = url.split(str(_URL_PLACEHOLDER))
+    if len(parts) == 1:
+        return (url, None, False)
+    if len(parts) != 2:
+        return None
+    return (parts[0], parts[1], "?" in parts[0])
+
+
+def build_url(endpoint, values, key=None):
+    """Build a URL like :func:`flask.url_for`, but using a template per request host.
+
+    The URL is built with :func:`flask.url_for` only once, afterwards only the value of
+    `key` is filled in. Ends up with exactly the same URLs as :func:`flask.url_for`.
+
+    :param str endpoint   Flask endpoint name.
+    :param dict values    Arguments for :func:`flask.url_for`.
+    :param str key        The argument that varies between calls, if any.
+
+    """
+    value = values.get(key)
+    if not has_request_context() or (key is not None and value is None):
+        return url_for(endpoint, **values)
+    placeholders = tuple((k, _URL_PLACEHOLDER if k == key else v) for k, v in values.items())
+    template = _url_template(request.url_root, endpoint, placeholders)
+    if template is None:
+        return url_for(endpoint, **values)
+    (prefix, suffix, in_query) = template
+    if suffix is None:
+        return prefix
+    if in_query:
+        return prefix + url_quote_plus(str(value)) + suffix
+    if isinstance(value, int) and not isinstance(value, bool):
+        return prefix + str(value) + suffix
+    return url_for(endpoint, **values)  # let the URL converter deal with it
+
+
+# Preloaded related keys
+
+
+@lru_cache(maxsize=None)
+def related_key_column(model, attribute, columns):
+    """Get the name of the column used as key for items related by `attribute`.
+
+    Returns `None` if the key consists of more than one column.
+
+    :param obj model        The :class:`~flask_sqlalchemy.Model` class with the relationship.
+    :param str attribute    Name of the relationship.
+    :param tuple columns    Column names configured for the field, the primary key if empty.
+
+    """
+    if columns:
+        return columns[0] if len(columns) == 1 else None
+    mapper = getattr(model, attribute).property.mapper
+    if len(mapper.primary_key) != 1:
+        return None
+    return mapper.get_property_by_column(mapper.primary_key[0]).key
+
+
+@lru_cache(maxsize=None)
+def owner_key_attribute(model, attribute, column):
+    """Get the attribute of `model` that items related by `attribute` reference with `column`.
+
+    Items of a one-to-many relationship that are keyed by their foreign key to `model` all
+    have the same key, the owner’s own value, so it doesn’t have to be loaded. Returns `None`
+    for other relationships and keys.
+
+    :param obj model        The :class:`~flask_sqlalchemy.Model` class with the relationship.
+    :param str attribute    Name of the relationship.
+    :param str column       Name of the related column used as key.
+
+    """
+    prop = getattr(model, attribute).property
+    if column is None or prop.direction is not ONETOMANY:
+        return None
+    remote = getattr(prop.mapper.attrs.get(column), "columns", [None])[0]
+    for (local, other) in prop.local_remote_pairs:
+        if other is remote:
+            return inspect(model).get_property_by_column(local).key
+    return None
+
+
+def _preloaded_keys(field, obj, attribute, columns):
+    # Get the keys of items related to `obj` that were loaded before dumping.
+    #
+    # Returns `None` if the keys haven’t been loaded, see
+    # :meth:`~supermarket.api.GenericResource._related_keys`.
+    #
+    preloaded = field.context.get("related_keys")
+    if not preloaded:
+        return None
+    column = related_key_column(type(obj), attribute, tuple(columns))
+    return preloaded.get((inspect(obj).identity_key, attribute, column))
+
+
 # Custom (overridden) fields
 
 
@@ -72,7 +189,8 @@ class HyperlinkRelated(ma.HyperlinkRelated):
 
         kwargs = {self.url_key: key}
         kwargs.update(self.params)
-        return url_for(self.endpoint, _external=self.external, **kwargs)
+        kwargs["_external"] = self.external
+        return build_url(self.endpoint, kwargs, self.url_key)
 
 
 class HyperlinkRelatedList(HyperlinkRelated):
@@ -98,8 +216,27 @@ class HyperlinkRelatedList(HyperlinkRelated):
             kwargs.update({"column": url_key})
         super().__init__(endpoint, params, url_key, external, **kwargs)
 
+    def owner_key(self, model, attribute=None):
+        """Get the attribute of `model` the link is built from, see :func:`owner_key_attribute`.
+
+        :param obj model        The :class:`~flask_sqlalchemy.Model` class with the relationship.
+        :param str attribute    Name of the relationship, defaults to the field’s `attribute`.
+
+        """
+        attribute = attribute or self.attribute
+        column = related_key_column(model, attribute, tuple(self.columns))
+        return owner_key_attribute(model, attribute, column)
+
     def _serialize(self, value, attr, obj):
-        keys = set(super(ma.HyperlinkRelated, self)._serialize(val, attr, obj) for val in value)
+        attribute = self.attribute or attr
+        owner_key = self.owner_key(type(obj), attribute)
+        keys = None if owner_key else _preloaded_keys(self, obj, attribute, self.columns)
+        if owner_key is not None:
+            keys = {getattr(obj, owner_key)}
+        elif keys is not None:
+            keys = set(keys)
+        else:
+            keys = set(super(ma.HyperlinkRelated, self)._serialize(v, attr, obj) for v in value)
         if None in keys:
             keys.remove(None)
         if not keys:
@@ -107,7 +244,57 @@ class HyperlinkRelatedList(HyperlinkRelated):
 
         kwargs = {"{}:in".format(self.url_key): ",".join(map(str, keys))}
         kwargs.update(self.params)
-        return url_for(self.endpoint, _external=self.external, **kwargs)
+        kwargs["_external"] = self.external
+        return build_url(self.endpoint, kwargs, "{}:in".format(self.url_key))
+
+
+class RelatedList(masqla_fields.RelatedList):
+
+    """Field for the keys of "many" relationships.
+
+    Like :class:`~marshmallow_sqlalchemy.fields.RelatedList`, but uses keys that were
+    loaded before dumping instead of the related items, if available.
+
+    """
+
+    def _serialize(self, value, attr, obj):
+        keys = _preloaded_keys(self, obj, self.attribute or attr, self.container.columns)
+        if keys is not None:
+            return list(keys)
+        return super()._serialize(value, attr, obj)
+
+
+class ModelConverter(BaseModelConverter):
+
+    """Converts "many" relationships to :class:`~supermarket.schema.RelatedList` fields."""
+
+    def property2field(self, prop, *, instance=True, field_class=None, **kwargs):
+        field = super().property2field(prop, instance=instance, field_class=field_class, **kwargs)
+        if isinstance(field, masqla_fields.RelatedList):
+            field = RelatedList(field.container, **kwargs)
+        return field
+
+
+class URLFor(ma.URLFor):
+
+    """Field that outputs the URL for an endpoint.
+
+    Like :class:`~flask_marshmallow.fields.URLFor`, but builds the URL with
+    :func:`~supermarket.schema.build_url` if at most one argument is pulled from the object.
+
+    """
+
+    def _serialize(self, value, key, obj):
+        templated = [n for n, v in self.params.items() if ma_tpl(str(v))]
+        if len(templated) > 1:
+            return super()._serialize(value, key, obj)
+        values = dict(self.params)
+        if templated:
+            attr_value = utils.get_value(ma_tpl(str(values[templated[0]])), obj, default=None)
+            if attr_value is None:
+                return super()._serialize(value, key, obj)
+            values[templated[0]] = attr_value
+        return build_url(self.endpoint, values, templated[0] if templated else None)
 
 
 class Hyperlinks(ma.Hyperlinks):
@@ -149,43 +336,55 @@ class CustomSchema(ma.ModelSchema):
         else:
             self.language = None
 
+    @classmethod
+    def field_metadata(cls):
+        """Get the keys of the schema’s fields grouped by kind.
+
+        The lookup tables are computed once per schema class, see :func:`init_field_metadata`.
+
+        """
+        if "_field_metadata" not in cls.__dict__:
+            nested, related, lists, translated = set(), set(), set(), set()
+            for key, field in cls().fields.items():
+                if isinstance(field, Nested):
+                    nested.add(key)
+                if isinstance(field, masqla_fields.Related):
+                    related.add(key)
+                if isinstance(field, ma.List) and isinstance(
+                    field.container, masqla_fields.Related
+                ):
+                    lists.add(key)
+                if isinstance(field, ma.Raw):
+                    attr = getattr(cls.opts.model, field.attribute or key)
+                    if isinstance(attr.type, m.Translation):
+                        translated.add(key)
+            cls._field_metadata = {
+                "nested": frozenset(nested),
+                "related": frozenset(related),
+                "related_lists": frozenset(lists),
+                "translated": frozenset(translated),
+            }
+        return cls._field_metadata
+
     @property
     def nested_fields(self):
         """Get the keys of all fields of type `Nested`."""
-        fields = []
-        for key, field in self.fields.items():
-            if isinstance(field, Nested):
-                fields.append(key)
-        return fields
+        return self.field_metadata()["nested"]
 
     @property
     def related_fields(self):
         """Get the keys of all fields of type `Related`."""
-        fields = []
-        for key, field in self.fields.items():
-            if isinstance(field, masqla_fields.Related):
-                fields.append(key)
-        return fields
+        return self.field_metadata()["related"]
 
     @property
     def related_lists(self):
         """Get the keys of all fields with a list of type `Related`."""
-        lists = []
-        for key, field in self.fields.items():
-            if isinstance(field, ma.List) and isinstance(field.container, masqla_fields.Related):
-                lists.append(key)
-        return lists
+        return self.field_metadata()["related_lists"]
 
     @property
     def translated_fields(self):
         """Get the keys of all fields that contain translations."""
-        fields = []
-        for key, field in self.fields.items():
-            if isinstance(field, ma.Raw):
-                attr = getattr(self.opts.model, field.attribute or field.name)
-                if isinstance(attr.type, m.Translation):
-                    fields.append(key)
-        return fields
+        return self.field_metadata()["translated"]
 
     @property
     def schema_description(self):
@@ -211,7 +410,7 @@ class CustomSchema(ma.ModelSchema):
                     only=self.fields[k].only, exclude=self.fields[k].exclude
                 )
                 d.update(nested_schema.schema_description)
-            if k in self.related_fields + self.related_lists:
+            if k in self.related_fields | self.related_lists:
                 if links and "related" in links and k in links["related"]:
                     link = self.fields["links"].schema["related"][k]
                     d["doc"] = url_for("api.resourcedoc", _external=True, **link.params)
@@ -277,30 +476,6 @@ class CustomSchema(ma.ModelSchema):
                             data[field] = None
         return data
 
-    @post_dump(pass_many=False)
-    def load_queried_nested_fields(self, data):
-        """Injects nested fields requested in `include` into the JSON dump.
-
-        Expects `include` in self.context, containing only valid values.
-
-        """
-        if "include" not in self.context:
-            return data
-        include = self.context["include"]
-        for key, v in include.items():
-            if key not in data or not data[key]:
-                continue
-            model = v["resource"].model
-            if isinstance(data[key], list):
-                primary_key = inspect(model).primary_key[0].name
-                query = model.query.filter(getattr(model, primary_key).in_(data[key])).all()
-                many = True
-            else:
-                query = model.query.get(data[key])
-                many = False
-            s = v["resource"].schema(many=many, only=v["only"], lang=self.language)
-            data[key] = s.dump(query).data
-
     @post_load
     def check_related_fields(self, data):
         """Only except ids for related fields if an entry with this id exists in the database."""
@@ -332,7 +507,19 @@ class CustomSchema(ma.ModelSchema):
         return data
 
     class Meta:
-        dump_only = ["id", "links"]  # read-only properties, will be ignored when loading
+        # read-only properties, will be ignored when loading
+        dump_only = ["id", "links", "updated_at"]
+        model_converter = ModelConverter
+
+
+def init_field_metadata():
+    """Compute the field metadata of all schemas up front."""
+    schemas = [CustomSchema]
+    while schemas:
+        schema = schemas.pop()
+        schemas.extend(schema.__subclasses__())
+        if schema.opts.model is not None:
+            schema.field_metadata()
 
 
 # Supermarket schemas
@@ -343,9 +530,9 @@ class Brand(CustomSchema):
     # refs: retailer, products, stores
     links = Hyperlinks(
         {
-            "self": ma.URLFor("api.resourceitem", type="brands", id="<id>", _external=True),
-            "list": ma.URLFor("api.resourcelist", type="brands", _external=True),
-            "doc": ma.URLFor("api.resourcedoc", type="brands", _external=True),
+            "self": URLFor("api.resourceitem", type="brands", id="<id>", _external=True),
+            "list": URLFor("api.resourcelist", type="brands", _external=True),
+            "doc": URLFor("api.resourcedoc", type="brands", _external=True),
             "related": {
                 "retailer": HyperlinkRelated(
                     "api.resourceitem", {"type": "retailers"}, external=True, attribute="retailer"
@@ -373,9 +560,9 @@ class Category(CustomSchema):
     # refs: products
     links = Hyperlinks(
         {
-            "self": ma.URLFor("api.resourceitem", type="categories", id="<id>", _external=True),
-            "list": ma.URLFor("api.resourcelist", type="categories", _external=True),
-            "doc": ma.URLFor("api.resourcedoc", type="categories", _external=True),
+            "self": URLFor("api.resourceitem", type="categories", id="<id>", _external=True),
+            "list": URLFor("api.resourcelist", type="categories", _external=True),
+            "doc": URLFor("api.resourcedoc", type="categories", _external=True),
             "related": {
                 "products": HyperlinkRelatedList(
                     "api.resourcelist",
@@ -400,9 +587,9 @@ class Criterion(CustomSchema):
 
     links = Hyperlinks(
         {
-            "self": ma.URLFor("api.resourceitem", type="criteria", id="<id>", _external=True),
-            "list": ma.URLFor("api.resourcelist", type="criteria", _external=True),
-            "doc": ma.URLFor("api.resourcedoc", type="criteria", _external=True),
+            "self": URLFor("api.resourceitem", type="criteria", id="<id>", _external=True),
+            "list": URLFor("api.resourcelist", type="criteria", _external=True),
+            "doc": URLFor("api.resourcedoc", type="criteria", _external=True),
             "related": {
                 "hotspots": HyperlinkRelatedList(
                     "api.resourcelist",
@@ -452,9 +639,9 @@ class Hotspot(CustomSchema):
 
     links = Hyperlinks(
         {
-            "self": ma.URLFor("api.resourceitem", type="hotspots", id="<id>", _external=True),
-            "list": ma.URLFor("api.resourcelist", type="hotspots", _external=True),
-            "doc": ma.URLFor("api.resourcedoc", type="hotspots", _external=True),
+            "self": URLFor("api.resourceitem", type="hotspots", id="<id>", _external=True),
+            "list": URLFor("api.resourcelist", type="hotspots", _external=True),
+            "doc": URLFor("api.resourcedoc", type="hotspots", _external=True),
         }
     )
 
@@ -492,9 +679,9 @@ class Label(CustomSchema):
 
     links = Hyperlinks(
         {
-            "self": ma.URLFor("api.resourceitem", type="labels", id="<id>", _external=True),
-            "list": ma.URLFor("api.resourcelist", type="labels", _external=True),
-            "doc": ma.URLFor("api.resourcedoc", type="labels", _external=True),
+            "self": URLFor("api.resourceitem", type="labels", id="<id>", _external=True),
+            "list": URLFor("api.resourcelist", type="labels", _external=True),
+            "doc": URLFor("api.resourcedoc", type="labels", _external=True),
             "related": {
                 "products": HyperlinkRelatedList(
                     "api.resourcelist", {"type": "products"}, external=True, attribute="products"
@@ -517,11 +704,7 @@ class Label(CustomSchema):
     )
 
     def get_hotspots(self, m):
-        hotspots = set()
-        for mc in m.meets_criteria:
-            for ih in mc.criterion.improves_hotspots:
-                hotspots.add(ih.hotspot)
-        return [h.id for h in hotspots]
+        return [h.id for h in m.hotspots]
 
     @property
     def schema_description(self):
@@ -536,10 +719,12 @@ class Label(CustomSchema):
         if "links" in data:
             hotspots_link = None
             if data["hotspots"]:
-                hotspots = {"id:in": ",".join(map(str, data["hotspots"]))}
-                hotspots_link = url_for(
-                    "api.resourcelist", type="hotspots", _external=True, **hotspots
-                )
+                hotspots = {
+                    "type": "hotspots",
+                    "_external": True,
+                    "id:in": ",".join(map(str, data["hotspots"])),
+                }
+                hotspots_link = build_url("api.resourcelist", hotspots, "id:in")
             data["links"]["related"]["hotspots"] = hotspots_link
         return data
 
@@ -570,9 +755,9 @@ class Origin(CustomSchema):
     # refs: ingredients, supplies
     links = Hyperlinks(
         {
-            "self": ma.URLFor("api.resourceitem", type="origins", id="<id>", _external=True),
-            "list": ma.URLFor("api.resourcelist", type="origins", _external=True),
-            "doc": ma.URLFor("api.resourcedoc", type="origins", _external=True),
+            "self": URLFor("api.resourceitem", type="origins", id="<id>", _external=True),
+            "list": URLFor("api.resourcelist", type="origins", _external=True),
+            "doc": URLFor("api.resourcedoc", type="origins", _external=True),
             "related": {
                 "supplies": HyperlinkRelatedList(
                     "api.resourcelist", {"type": "supplies"}, external=True, attribute="supplies"
@@ -597,9 +782,9 @@ class Producer(CustomSchema):
     # refs: products
     links = Hyperlinks(
         {
-            "self": ma.URLFor("api.resourceitem", type="producers", id="<id>", _external=True),
-            "list": ma.URLFor("api.resourcelist", type="producers", _external=True),
-            "doc": ma.URLFor("api.resourcedoc", type="producers", _external=True),
+            "self": URLFor("api.resourceitem", type="producers", id="<id>", _external=True),
+            "list": URLFor("api.resourcelist", type="producers", _external=True),
+            "doc": URLFor("api.resourcedoc", type="producers", _external=True),
             "related": {
                 "products": HyperlinkRelatedList(
                     "api.resourcelist",
@@ -618,14 +803,15 @@ class Producer(CustomSchema):
 
 class Product(CustomSchema):
     # id, name, details (JSONB), gtin
-    # refs: brand, category, prodcuer, ingredients, labels, stores
+    # refs: brand, category, prodcuer, ingredients, labels, stores, scores
     ingredients = Nested("Ingredient", exclude=["product"], many=True)
+    scores = Nested("ProductScore", only=("overall", "hotspots"), dump_only=True)
 
     links = Hyperlinks(
         {
-            "self": ma.URLFor("api.resourceitem", type="products", id="<id>", _external=True),
-            "list": ma.URLFor("api.resourcelist", type="products", _external=True),
-            "doc": ma.URLFor("api.resourcedoc", type="products", _external=True),
+            "self": URLFor("api.resourceitem", type="products", id="<id>", _external=True),
+            "list": URLFor("api.resourcelist", type="products", _external=True),
+            "doc": URLFor("api.resourcedoc", type="products", _external=True),
             "related": {
                 "brand": HyperlinkRelated(
                     "api.resourceitem", {"type": "brands"}, external=True, attribute="brand"
@@ -671,14 +857,22 @@ class Product(CustomSchema):
         model = m.Product
 
 
+class ProductScore(CustomSchema):
+    # primary key: product_id
+    # overall, hotspots (JSONB)
+
+    class Meta(CustomSchema.Meta):
+        model = m.ProductScore
+
+
 class Resource(CustomSchema):
     # id, name
     # refs: ingredients, labels, supplies
     links = Hyperlinks(
         {
-            "self": ma.URLFor("api.resourceitem", type="resources", id="<id>", _external=True),
-            "list": ma.URLFor("api.resourcelist", type="resources", _external=True),
-            "doc": ma.URLFor("api.resourcedoc", type="resources", _external=True),
+            "self": URLFor("api.resourceitem", type="resources", id="<id>", _external=True),
+            "list": URLFor("api.resourcelist", type="resources", _external=True),
+            "doc": URLFor("api.resourcedoc", type="resources", _external=True),
             "related": {
                 "labels": HyperlinkRelatedList(
                     "api.resourcelist", {"type": "labels"}, external=True, attribute="labels"
@@ -712,9 +906,9 @@ class Retailer(CustomSchema):
 
     links = Hyperlinks(
         {
-            "self": ma.URLFor("api.resourceitem", type="retailers", id="<id>", _external=True),
-            "list": ma.URLFor("api.resourcelist", type="retailers", _external=True),
-            "doc": ma.URLFor("api.resourcedoc", type="retailers", _external=True),
+            "self": URLFor("api.resourceitem", type="retailers", id="<id>", _external=True),
+            "list": URLFor("api.resourcelist", type="retailers", _external=True),
+            "doc": URLFor("api.resourcedoc", type="retailers", _external=True),
             "related": {
                 "brands": HyperlinkRelatedList(
                     "api.resourcelist",
@@ -789,9 +983,9 @@ class Store(CustomSchema):
     # refs: retailer, brands, products
     links = Hyperlinks(
         {
-            "self": ma.URLFor("api.resourceitem", type="stores", id="<id>", _external=True),
-            "list": ma.URLFor("api.resourcelist", type="stores", _external=True),
-            "doc": ma.URLFor("api.resourcedoc", type="stores", _external=True),
+            "self": URLFor("api.resourceitem", type="stores", id="<id>", _external=True),
+            "list": URLFor("api.resourcelist", type="stores", _external=True),
+            "doc": URLFor("api.resourcedoc", type="stores", _external=True),
             "related": {
                 "retailer": HyperlinkRelated(
                     "api.resourceitem", {"type": "retailers"}, external=True, attribute="retailer"
@@ -815,9 +1009,9 @@ class Supplier(CustomSchema):
     # refs: ingredients, supplies
     links = Hyperlinks(
         {
-            "self": ma.URLFor("api.resourceitem", type="suppliers", id="<id>", _external=True),
-            "list": ma.URLFor("api.resourcelist", type="suppliers", _external=True),
-            "doc": ma.URLFor("api.resourcedoc", type="suppliers", _external=True),
+            "self": URLFor("api.resourceitem", type="suppliers", id="<id>", _external=True),
+            "list": URLFor("api.resourcelist", type="suppliers", _external=True),
+            "doc": URLFor("api.resourcedoc", type="suppliers", _external=True),
             "related": {
                 "supplies": HyperlinkRelatedList(
                     "api.resourcelist",
@@ -848,9 +1042,9 @@ class Supply(CustomSchema):
 
     links = Hyperlinks(
         {
-            "self": ma.URLFor("api.resourceitem", type="supplies", id="<id>", _external=True),
-            "list": ma.URLFor("api.resourcelist", type="supplies", _external=True),
-            "doc": ma.URLFor("api.resourcedoc", type="supplies", _external=True),
+            "self": URLFor("api.resourceitem", type="supplies", id="<id>", _external=True),
+            "list": URLFor("api.resourcelist", type="supplies", _external=True),
+            "doc": URLFor("api.resourcedoc", type="supplies", _external=True),
             "related": {
                 "resource": HyperlinkRelated(
                     "api.resourceitem", {"type": "resources"}, external=True, attribute="resource"
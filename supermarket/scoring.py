@@ -0,0 +1,383 @@
+"""Sustainability scores of products.
+
+The scores are derived from data that is already in the database and stored in the
+`product_scores` table, so that products can be sorted and filtered by them:
+
+overall
+    The best overall score of the product’s labels (0–100). The overall score of a label is
+    the mean of its numeric category scores in `Label.details["score"]`. Products without
+    labels score 0.
+hotspots
+    Scores per hotspot ID:
+
+    improvement
+        The most points any of the product’s labels gets for the hotspot: the sum of
+        `LabelMeetsCriterion.score` × `CriterionImprovesHotspot.weight` over the criteria
+        the label meets that improve the hotspot.
+    risk
+        The mean `Score.score` of the supplies matching the product’s ingredients, weighted
+        by the ingredients’ share of the product, see :func:`hotspot_profiles`.
+
+Scores are recomputed for the affected products whenever the inputs change in a flush and
+can be rebuilt for all products with :func:`refresh_product_scores`.
+
+"""
+
+from collections import defaultdict
+
+from sqlalchemy import Float, Text, and_, case, cast, event, func, literal_column, or_, select
+from sqlalchemy.inspection import inspect
+from sqlalchemy.orm import Session, object_session
+
+from . import model as m
+
+
+def supply_matches(ingredients=None):
+    """Get the condition for joining ingredients with the supplies they stem from.
+
+    A supply matches an ingredient if it is a supply of the ingredient’s resource and
+    from the ingredient’s origin and supplier, as far as those are known.
+
+    :param obj ingredients  Selectable with the ingredients’ `resource_id`, `origin_id` and
+                            `supplier_id` columns (default: the `ingredients` table).
+
+    """
+    i = (m.Ingredient.__table__ if ingredients is None else ingredients).c
+    return and_(
+        m.Supply.resource_id == i.resource_id,
+        or_(i.origin_id.is_(None), m.Supply.origin_id == i.origin_id),
+        or_(i.supplier_id.is_(None), m.Supply.supplier_id == i.supplier_id),
+    )
+
+
+def ingredient_shares(product_ids=None):
+    """Get the share of each ingredient in its product in percent.
+
+    Returns a selectable of the ingredients’ `product_id`, `weight`, `resource_id`,
+    `origin_id` and `supplier_id` and their `share`. Ingredients with a known `percentage`
+    have that share. The rest of the product is split among the other ingredients, weighted
+    by their position (`weight`) on the ingredients list: the first one counts 1, the
+    second one ½, the third one ⅓ and so on.
+
+    :param list product_ids  The IDs of the products (default: all products).
+
+    """
+    i = m.Ingredient
+    position = func.row_number().over(partition_by=i.product_id, order_by=i.weight)
+    ranked = select(
+        [
+            i.product_id,
+            i.weight,
+            i.resource_id,
+            i.origin_id,
+            i.supplier_id,
+            i.percentage,
+            (1.0 / position).label("rank"),
+        ]
+    )
+    if product_ids is not None:
+        ranked = ranked.where(i.product_id.in_(product_ids))
+    ranked = ranked.alias("ranked")
+    product = {"partition_by": ranked.c.product_id}
+    known = func.coalesce(func.sum(ranked.c.percentage).over(**product), 0)
+    unknown = func.sum(case([(ranked.c.percentage.is_(None), ranked.c.rank)])).over(**product)
+    rest = func.greatest(100 - known, 0) * ranked.c.rank / unknown
+    share = cast(func.coalesce(ranked.c.percentage, rest), Float)
+    return select(
+        [
+            ranked.c.product_id,
+            ranked.c.weight,
+            ranked.c.resource_id,
+            ranked.c.origin_id,
+            ranked.c.supplier_id,
+            share.label("share"),
+        ]
+    ).alias("ingredients")
+
+
+def hotspot_profiles(session, product_ids=None):
+    """Compute the hotspot risks of products from the supplies of their ingredients.
+
+    The risk of an ingredient for a hotspot is the mean score of its matching supplies, see
+    :func:`supply_matches`. The risk of a product is the mean risk of its ingredients,
+    weighted by their share, see :func:`ingredient_shares`.
+
+    Returns a dict mapping product IDs to dicts mapping hotspot IDs to the product’s `risk`,
+    the highest risk of any ingredient (`max`) and the share of the ingredients with a risk
+    (`share`, in percent).
+
+    :param obj session       The session to query.
+    :param list product_ids  The IDs of the products (default: all products).
+
+    """
+    ingredients = ingredient_shares(product_ids)
+    risks = (
+        select(
+            [
+                ingredients.c.product_id,
+                ingredients.c.weight,
+                ingredients.c.share,
+                m.Score.hotspot_id,
+                func.avg(m.Score.score).label("risk"),
+            ]
+        )
+        .select_from(
+            ingredients.join(m.Supply.__table__, supply_matches(ingredients)).join(
+                m.Score.__table__, m.Score.supply_id == m.Supply.id
+            )
+        )
+        .group_by(
+            ingredients.c.product_id,
+            ingredients.c.weight,
+            ingredients.c.share,
+            m.Score.hotspot_id,
+        )
+        .alias("risks")
+    )
+    share = func.sum(risks.c.share)
+    query = select(
+        [
+            risks.c.product_id,
+            risks.c.hotspot_id,
+            func.sum(risks.c.share * risks.c.risk) / func.nullif(share, 0),
+            func.max(risks.c.risk),
+            share,
+        ]
+    ).group_by(risks.c.product_id, risks.c.hotspot_id)
+    profiles = {}
+    for (product_id, hotspot_id, risk, max_risk, share) in session.execute(query):
+        profiles.setdefault(product_id, {})[hotspot_id] = {
+            "risk": risk,
+            "max": float(max_risk),
+            "share": share,
+        }
+    return profiles
+
+
+def compute_product_scores(session, product_ids=None):
+    """Compute the scores of products in batch.
+
+    Returns a dict mapping product IDs to dicts with the `overall` and `hotspots` scores and
+    the product’s `category_id`.
+
+    :param obj session      The session to query.
+    :param set product_ids  Only compute the scores of these products (default: all products).
+
+    """
+    product_id = m.products_labels.c.product_id
+    query = select([m.Product.id, m.Product.category_id])
+    if product_ids is not None:
+        query = query.where(m.Product.id.in_(product_ids))
+    scores = {
+        id: {"category_id": category_id, "overall": 0, "hotspots": {}}
+        for (id, category_id) in session.execute(query)
+    }
+    if not scores:
+        return scores
+
+    def only_products(query):
+        # Filter a query by `product_ids` unless all products are scored.
+        if product_ids is None:
+            return query
+        return query.where(product_id.in_(product_ids))
+
+    # overall: the best label score
+    # (anything but an object of numbers is skipped, a label can’t break the flush)
+    details_score = m.Label.details["score"]
+    category_score = literal_column("value")
+    label_score = (
+        select([func.avg(cast(cast(category_score, Text), Float))])
+        .select_from(
+            func.jsonb_each(case([(func.jsonb_typeof(details_score) == "object", details_score)]))
+        )
+        .where(func.jsonb_typeof(category_score) == "number")
+        .as_scalar()
+    )
+    labels = select([m.Label.id.label("label_id"), label_score.label("score")]).alias("labels")
+    query = only_products(
+        select([product_id, func.max(labels.c.score)])
+        .select_from(
+            m.products_labels.join(labels, labels.c.label_id == m.products_labels.c.label_id)
+        )
+        .group_by(product_id)
+    )
+    for (id, overall) in session.execute(query):
+        scores[id]["overall"] = overall or 0
+
+    # improvement: the most points of any label per hotspot
+    points = (
+        select(
+            [
+                m.LabelMeetsCriterion.label_id,
+                m.CriterionImprovesHotspot.hotspot_id,
+                func.sum(m.LabelMeetsCriterion.score * m.CriterionImprovesHotspot.weight).label(
+                    "points"
+                ),
+            ]
+        )
+        .select_from(
+            m.LabelMeetsCriterion.__table__.join(
+                m.CriterionImprovesHotspot.__table__,
+                m.LabelMeetsCriterion.criterion_id == m.CriterionImprovesHotspot.criterion_id,
+            )
+        )
+        .group_by(m.LabelMeetsCriterion.label_id, m.CriterionImprovesHotspot.hotspot_id)
+        .alias("points")
+    )
+    query = only_products(
+        select([product_id, points.c.hotspot_id, func.max(points.c.points)])
+        .select_from(
+            m.products_labels.join(points, points.c.label_id == m.products_labels.c.label_id)
+        )
+        .group_by(product_id, points.c.hotspot_id)
+    )
+    for (id, hotspot_id, improvement) in session.execute(query):
+        _hotspot(scores[id], hotspot_id)["improvement"] = improvement
+
+    # risk: the weighted mean score of the ingredients’ supplies per hotspot
+    for (id, hotspots) in hotspot_profiles(session, product_ids).items():
+        for (hotspot_id, profile) in hotspots.items():
+            _hotspot(scores[id], hotspot_id)["risk"] = profile["risk"]
+
+    return scores
+
+
+def _hotspot(scores, hotspot_id):
+    # Get the scores of a product for a hotspot, see `compute_product_scores`.
+    return scores["hotspots"].setdefault(str(hotspot_id), {"improvement": None, "risk": None})
+
+
+def refresh_product_scores(session, product_ids=None):
+    """Recompute the `product_scores` table.
+
+    :param obj session      The session to use for the update.
+    :param set product_ids  Only update the scores of these products (default: all products).
+
+    """
+    table = m.ProductScore.__table__
+    delete = table.delete()
+    if product_ids is not None:
+        delete = delete.where(table.c.product_id.in_(product_ids))
+    session.execute(delete)
+    scores = compute_product_scores(session, product_ids)
+    if scores:
+        session.execute(
+            table.insert(), [dict(product_id=id, **score) for (id, score) in scores.items()]
+        )
+
+
+# incremental updates
+
+
+def _changed_ids(session, kind):
+    # Get the set of IDs of a kind whose scores or score inputs changed in the current flush.
+    return session.info.setdefault("product_scores_changed", defaultdict(set))[kind]
+
+
+def _note_changed(target, kind, key):
+    # Add the current and previous values of `target.<key>` to the changed IDs of `kind`.
+    ids = _changed_ids(object_session(target), kind)
+    ids |= set(v for v in getattr(inspect(target).attrs, key).history.sum() if v is not None)
+
+
+@event.listens_for(m.Product, "after_insert")
+@event.listens_for(m.Product, "after_update")
+def _product_changed(mapper, connection, target):
+    _note_changed(target, "products", "id")
+
+
+@event.listens_for(m.Ingredient, "after_insert")
+@event.listens_for(m.Ingredient, "after_update")
+@event.listens_for(m.Ingredient, "after_delete")
+def _ingredient_changed(mapper, connection, target):
+    _note_changed(target, "products", "product_id")
+
+
+@event.listens_for(m.Label, "after_update")
+def _label_changed(mapper, connection, target):
+    _note_changed(target, "labels", "id")
+
+
+@event.listens_for(Session, "before_flush")
+def _labels_deleted(session, flush_context, instances):
+    # The products of deleted labels have to be looked up before the flush removes the labels’
+    # rows in products_labels.
+    label_ids = [obj.id for obj in session.deleted if isinstance(obj, m.Label)]
+    if label_ids:
+        _changed_ids(session, "products").update(
+            _lookup(
+                session, m.products_labels.c.product_id, m.products_labels.c.label_id, label_ids
+            )
+        )
+
+
+@event.listens_for(Session, "before_flush")
+def _product_labels_changed(session, flush_context, instances):
+    # Products added to or removed from a label’s `products` are changed as well, whether or
+    # not the products’ own `labels` were updated by the backref.
+    for label in session.dirty:
+        if isinstance(label, m.Label):
+            history = inspect(label).attrs.products.history
+            products = list(history.added or ()) + list(history.deleted or ())
+            ids = [p.id for p in products if p.id is not None]
+            if ids:
+                _changed_ids(session, "products").update(ids)
+
+
+@event.listens_for(m.LabelMeetsCriterion, "after_insert")
+@event.listens_for(m.LabelMeetsCriterion, "after_update")
+@event.listens_for(m.LabelMeetsCriterion, "after_delete")
+def _label_criteria_changed(mapper, connection, target):
+    _note_changed(target, "labels", "label_id")
+
+
+@event.listens_for(m.CriterionImprovesHotspot, "after_insert")
+@event.listens_for(m.CriterionImprovesHotspot, "after_update")
+@event.listens_for(m.CriterionImprovesHotspot, "after_delete")
+def _criterion_hotspots_changed(mapper, connection, target):
+    _note_changed(target, "criteria", "criterion_id")
+
+
+@event.listens_for(m.Score, "after_insert")
+@event.listens_for(m.Score, "after_update")
+@event.listens_for(m.Score, "after_delete")
+def _score_changed(mapper, connection, target):
+    _note_changed(target, "supplies", "supply_id")
+
+
+@event.listens_for(m.Supply, "after_insert")
+@event.listens_for(m.Supply, "after_update")
+@event.listens_for(m.Supply, "after_delete")
+def _supply_changed(mapper, connection, target):
+    _note_changed(target, "resources", "resource_id")
+
+
+@event.listens_for(Session, "after_flush")
+def _update_product_scores(session, flush_context):
+    # Recompute the scores of products whose labels, ingredients or supplies changed.
+    changed = session.info.pop("product_scores_changed", None)
+    if not changed:
+        return
+    label_ids = changed["labels"] | _lookup(
+        session,
+        m.LabelMeetsCriterion.label_id,
+        m.LabelMeetsCriterion.criterion_id,
+        changed["criteria"],
+    )
+    resource_ids = changed["resources"] | _lookup(
+        session, m.Supply.resource_id, m.Supply.id, changed["supplies"]
+    )
+    product_ids = (
+        changed["products"]
+        | _lookup(session, m.products_labels.c.product_id, m.products_labels.c.label_id, label_ids)
+        | _lookup(session, m.Ingredient.product_id, m.Ingredient.resource_id, resource_ids)
+    )
+    if product_ids:
+        refresh_product_scores(session, product_ids)
+
+
+def _lookup(session, column, key, ids):
+    # Get the distinct values of `column` in rows whose `key` is one of `ids`.
+    if not ids:
+        return set()
+    return set(row[0] for row in session.execute(select([column]).where(key.in_(ids))))
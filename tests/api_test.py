@@ -30,6 +30,16 @@ class TestFormerBugs:
         assert res.json["message"] == "Validation error."
         assert res.json["errors"][0]["messages"]["0"]["criterion"][0] == "No language specified."
 
+    def test_validation_errors_not_shared(self):
+        """All ValidationFailed exceptions shared one class-level `data` dict."""
+        first = api.ValidationFailed({"name": ["Missing."]})
+        second = api.ValidationFailed({"id": ["Invalid."]}, "Invalid parameters.")
+        assert first.data == {
+            "message": "Validation error.",
+            "errors": [{"field": "name", "messages": ["Missing."]}],
+        }
+        assert second.data["errors"] == [{"field": "id", "messages": ["Invalid."]}]
+
 
 @pytest.mark.usefixtures("client_class", "db")
 class TestProductApi:
@@ -594,6 +604,125 @@ class TestLabelApiPagination:
         assert "limit=1" in prev_url
         assert self.client.get(prev_url).status_code == 200
 
+    def test_count_exact(self):
+        res = self.client.get(url_for(api.ResourceList, type="labels", limit=1, page=2))
+        assert res.json["pages"]["count"] == "exact"
+        assert res.json["pages"]["total"] == 2
+
+    def test_count_estimate(self):
+        res = self.client.get(url_for(api.ResourceList, type="labels", limit=1, count="estimate"))
+        assert res.status_code == 200
+        assert res.json["pages"]["count"] == "estimate"
+        assert res.json["pages"]["total"] >= 2
+        assert "page=2" in res.json["pages"]["next_url"]
+
+        res = self.client.get(
+            url_for(api.ResourceList, type="labels", limit=1, count="estimate", **{"name.en": "B"})
+        )
+        assert res.status_code == 200
+        assert res.json["pages"]["count"] == "estimate"
+        assert res.json["pages"]["total"] >= 1
+
+    def test_count_estimate_since(self, monkeypatch):
+        resource = api.resources["labels"]
+        calls = []
+
+        def estimate_count(query, filtered):
+            calls.append(filtered)
+            return 2
+
+        monkeypatch.setattr(resource, "_estimate_count", estimate_count)
+        self.client.get(url_for(api.ResourceList, type="labels", limit=1, count="estimate"))
+        url = url_for(api.ResourceList, type="labels", limit=1, count="estimate", since="")
+        self.client.get(url)
+        assert calls == [False, True]
+
+    def test_count_none(self):
+        res = self.client.get(url_for(api.ResourceList, type="labels", limit=1, count="none"))
+        assert res.status_code == 200
+        assert res.json["pages"]["count"] == "none"
+        assert res.json["pages"]["total"] is False
+        assert res.json["pages"]["next"] == 2
+
+        res = self.client.get(res.json["pages"]["next_url"])
+        assert res.status_code == 200
+        assert res.json["items"][0]["name"]["en"] == "B"
+        assert res.json["pages"]["next_url"] is False
+
+    def test_count_unknown(self):
+        res = self.client.get(url_for(api.ResourceList, type="labels", count="nonsense"))
+        assert res.status_code == 200
+        assert res.json["pages"]["count"] == "exact"
+        assert res.json["errors"][0]["errors"][0]["param"] == "count"
+
+    def test_cursor_pages(self):
+        res = self.client.get(url_for(api.ResourceList, type="labels", limit=1, cursor=""))
+        assert res.status_code == 200
+        assert res.json["items"][0]["name"]["en"] == "A"
+        assert "total" not in res.json["pages"]
+
+        next_url = res.json["pages"]["next_url"]
+        assert "cursor={}".format(res.json["pages"]["next_cursor"]) in next_url
+        res = self.client.get(next_url)
+        assert res.status_code == 200
+        assert res.json["items"][0]["name"]["en"] == "B"
+        assert res.json["pages"]["next_cursor"] is False
+        assert res.json["pages"]["next_url"] is False
+
+    def test_cursor_with_sort(self):
+        res = self.client.get(
+            url_for(api.ResourceList, type="labels", limit=1, cursor="", sort="-name", lang="en")
+        )
+        assert res.status_code == 200
+        assert res.json["items"][0]["name"] == "B"
+
+        res = self.client.get(res.json["pages"]["next_url"])
+        assert res.status_code == 200
+        assert len(res.json["errors"]) == 0
+        assert res.json["items"][0]["name"] == "A"
+        assert res.json["pages"]["next_url"] is False
+
+    def test_cursor_with_null_values(self):
+        url = url_for(api.ResourceList, type="labels", limit=1, cursor="", sort="-details")
+        res = self.client.get(url)
+        assert res.json["items"][0]["name"]["en"] == "A"
+
+        res = self.client.get(res.json["pages"]["next_url"])
+        assert len(res.json["errors"]) == 0
+        assert res.json["items"][0]["name"]["en"] == "B"
+        assert res.json["pages"]["next_url"] is False
+
+    def test_cursor_with_filter(self):
+        res = self.client.get(
+            url_for(api.ResourceList, type="labels", limit=1, cursor="", **{"name.en:ne": "A"})
+        )
+        assert res.status_code == 200
+        assert len(res.json["items"]) == 1
+        assert res.json["items"][0]["name"]["en"] == "B"
+        assert res.json["pages"]["next_url"] is False
+
+    def test_cursor_with_other_sort(self):
+        res = self.client.get(url_for(api.ResourceList, type="labels", limit=1, cursor=""))
+        cursor = res.json["pages"]["next_cursor"]
+        res = self.client.get(
+            url_for(api.ResourceList, type="labels", limit=1, cursor=cursor, sort="-id")
+        )
+        assert res.status_code == 200
+        assert res.json["errors"][0]["errors"][0]["param"] == "cursor"
+        assert res.json["items"][0]["name"]["en"] == "B"
+
+    def test_cursor_with_invalid_limit(self):
+        for limit in [0, -1]:
+            res = self.client.get(url_for(api.ResourceList, type="labels", limit=limit, cursor=""))
+            assert res.status_code == 400
+            assert res.json["errors"][0]["field"] == "limit"
+
+    def test_invalid_cursor(self):
+        res = self.client.get(url_for(api.ResourceList, type="labels", cursor="nonsense"))
+        assert res.status_code == 200
+        assert len(res.json["items"]) == 2
+        assert res.json["errors"][0]["errors"][0]["message"] == "Invalid cursor."
+
 
 @pytest.mark.usefixtures("client_class", "db")
 class TestApiDoc:
@@ -610,4 +739,5 @@ class TestApiDoc:
         res = self.client.get(url_for(api.ResourceDoc, type="labels"))
         assert res.status_code == 200
         assert res.mimetype == "application/json"
-        assert len(res.json["fields"]) == 13
+        assert len(res.json["fields"]) == 14
+        assert res.json["fields"]["updated_at"]["read-only"] is True
@@ -0,0 +1,49 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import supermarket.api as api
+import supermarket.model as m
+
+url_for = api.api.url_for
+
+
+@pytest.fixture(scope="class")
+def products(app, db):
+    with app.app_context():
+        for (en, de) in [("Apple", "Apfel"), ("Pear", "Birne"), ("Plum", "Pflaume")]:
+            db.session.add(m.Product(name={"en": en, "de": de}))
+        db.session.commit()
+
+
+@pytest.mark.usefixtures("db", "products")
+class TestConcurrentRequests:
+    def test_languages_do_not_leak_between_threads(self, app):
+        """Requests in different languages running at the same time get their own language."""
+        expected = {"en": "Pear", "de": "Birne"}
+        with app.test_request_context():
+            urls = {
+                lang: url_for(api.ResourceList, type="products", lang=lang, name=name, sort="name")
+                for lang, name in expected.items()
+            }
+
+        def get(lang):
+            with app.test_client() as client:
+                res = client.get(urls[lang])
+                assert res.status_code == 200
+                return (lang, [item["name"] for item in res.json["items"]], res.json["errors"])
+
+        # switch threads as often as possible to provoke races
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                results = list(executor.map(get, ["en", "de"] * 100))
+        finally:
+            sys.setswitchinterval(interval)
+
+        for (lang, names, errors) in results:
+            assert errors == []
+            assert names == [expected[lang]]
+        assert not hasattr(api.resources["products"], "language")
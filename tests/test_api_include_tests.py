@@ -179,6 +179,18 @@ class TestLabelQueryInclude:
             == "The test improvement criterion"
         )
 
+    def test_include_items_loaded_for_the_page(self):
+        """Included items were dumped with the relationships loaded for the page."""
+        url = url_for(api.ResourceItem, type="criteria", id=1)
+        criterion = self.client.get(url).json["item"]
+        url = url_for(api.ResourceItem, type="labels", id=1, include="meets_criteria.criterion.all")
+        res = self.client.get(url)
+
+        assert res.status_code == 200
+        included = res.json["item"]["meets_criteria"][0]["criterion"]
+        assert included["improves_hotspots"] == criterion["improves_hotspots"]
+        assert included["category"] == criterion["category"]
+
     def test_include_criteria_in_list(self):
         url = url_for(api.ResourceList, type="labels", include="meets_criteria.criterion.name")
         res = self.client.get(url)
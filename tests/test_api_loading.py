@@ -0,0 +1,170 @@
+import pytest
+from sqlalchemy import event
+
+import supermarket.api as api
+import supermarket.model as m
+
+url_for = api.api.url_for
+
+
+@pytest.fixture
+def queries(app):
+    """Collect all SQL statements executed while the fixture is active."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        if statement != "SELECT 1":  # connection check
+            statements.append(statement)
+
+    with app.app_context():
+        engine = m.db.engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def add_products(app, db, number):
+    with app.app_context():
+        retailer = m.Retailer(name="Retailer")
+        store = m.Store(name="Store", retailer=retailer)
+        brand = m.Brand(name="Brand", retailer=retailer)
+        category = m.Category(name="Category")
+        producer = m.Producer(name="Producer")
+        label = m.Label(name={"en": "Label {}".format(number)})
+        resource = m.Resource(name={"en": "Resource"})
+        origin = m.Origin(name={"en": "Origin"})
+        for i in range(number):
+            product = m.Product(
+                name={"en": "Product {}".format(i)},
+                brand=brand,
+                category=category,
+                producer=producer,
+                labels=[label],
+                stores=[store],
+            )
+            m.Ingredient(weight=1, product=product, resource=resource, origin=origin)
+            db.session.add(product)
+        db.session.commit()
+
+
+@pytest.mark.usefixtures("client_class", "db")
+class TestEagerLoading:
+    def test_list_queries_independent_of_page_size(self, app, db, queries):
+        add_products(app, db, 2)
+        queries.clear()
+        res = self.client.get(url_for(api.ResourceList, type="products", limit=50))
+        assert res.status_code == 200
+        assert len(res.json["items"]) == 2
+        few = len(queries)
+
+        add_products(app, db, 10)
+        queries.clear()
+        res = self.client.get(url_for(api.ResourceList, type="products", limit=50))
+        assert res.status_code == 200
+        assert len(res.json["items"]) == 12
+        assert len(queries) == few
+
+    def test_only_skips_relationships(self, queries):
+        res = self.client.get(url_for(api.ResourceList, type="products", limit=50, only="name"))
+        assert res.status_code == 200
+        assert set(res.json["items"][0].keys()) == {"name"}
+        assert len(queries) == 2
+        assert "FROM table_versions" in queries[0]  # conditional GET check
+        assert "products.name" in queries[1]
+        assert "products.details" not in queries[1]
+
+    def test_translations_selected_in_sql(self, queries):
+        res = self.client.get(url_for(api.ResourceList, type="products", only="name", lang="de"))
+        assert res.status_code == 200
+        assert len(queries) == 2
+        assert "coalesce(products.name -> %(name_1)s" in queries[1]
+        assert "products.name AS products_name" not in queries[1]
+
+    def test_item_links(self, queries):
+        res = self.client.get(url_for(api.ResourceItem, type="products", id=1))
+        assert res.status_code == 200
+        links = res.json["item"]["links"]["related"]
+        assert links["brand"].endswith("/brands/1")
+        assert "/labels?id%3Ain=1" in links["labels"]
+        assert "/origins?id%3Ain=1" in links["origins"]
+
+
+@pytest.mark.usefixtures("client_class", "db")
+class TestBatchInclude:
+    def test_include_queries_independent_of_page_size(self, app, db, queries):
+        add_products(app, db, 2)
+        queries.clear()
+        url = url_for(api.ResourceList, type="products", limit=50, include="labels.all,brand.name")
+        res = self.client.get(url)
+        assert res.status_code == 200
+        assert res.json["items"][0]["brand"] == {"name": "Brand"}
+        assert res.json["items"][0]["labels"][0]["name"] == {"en": "Label 2"}
+        few = len(queries)
+
+        add_products(app, db, 10)
+        queries.clear()
+        res = self.client.get(url)
+        assert res.status_code == 200
+        assert res.json["items"][11]["labels"][0]["name"] == {"en": "Label 10"}
+        assert len(queries) == few
+
+
+@pytest.mark.usefixtures("client_class", "db")
+class TestRelatedKeys:
+    def test_related_lists_without_loading_items(self, app, db, queries):
+        add_products(app, db, 3)
+        queries.clear()
+        res = self.client.get(url_for(api.ResourceList, type="labels"))
+        assert res.status_code == 200
+        label = res.json["items"][0]
+        assert label["products"] == [1, 2, 3]
+        assert label["links"]["related"]["products"].endswith("/products?id%3Ain=1%2C2%2C3")
+        assert label["links"]["related"]["criteria"] is None
+        assert not any("products.name" in q for q in queries)
+
+    def test_foreign_key_links_without_loading_keys(self, app, db, queries):
+        add_products(app, db, 2)
+        queries.clear()
+        res = self.client.get(url_for(api.ResourceList, type="brands"))
+        assert res.status_code == 200
+        brand = res.json["items"][0]
+        assert brand["links"]["related"]["products"].endswith("/products?brand_id%3Ain=1")
+        assert not any("products.brand_id AS" in q for q in queries)
+
+    def test_foreign_key_links_without_loading_items(self, app, db, queries):
+        add_products(app, db, 1)
+        queries.clear()
+        res = self.client.get(url_for(api.ResourceList, type="categories", only="links"))
+        assert res.status_code == 200
+        links = res.json["items"][0]["links"]["related"]
+        assert links["products"].endswith("/products?category_id%3Ain=1")
+        assert not any("products" in q for q in queries)
+
+    def test_item(self):
+        res = self.client.get(url_for(api.ResourceItem, type="retailers", id=1))
+        assert res.status_code == 200
+        assert res.json["item"]["stores"] == [1]
+        assert res.json["item"]["links"]["related"]["brands"].endswith("/brands?retailer_id%3Ain=1")
+
+
+class TestFieldResolver:
+    def test_resolved_paths_are_memoized(self):
+        resource = api.resources["products"]
+        resource._resolve_field.cache_clear()
+        (attr, relations, keys, target) = resource._resolve_field("brand.name")
+        assert attr is m.Brand.name
+        assert len(relations) == 1 and relations[0] is m.Product.brand
+        assert keys == ()
+        assert target is api.resources["brands"]
+        resource._resolve_field("brand.name")
+        assert resource._resolve_field.cache_info().hits == 1
+
+    def test_json_keys(self):
+        (attr, relations, keys, target) = api.resources["products"]._resolve_field("details.a.b")
+        assert attr is m.Product.details
+        assert relations == ()
+        assert keys == ("a", "b")
+
+    def test_unknown_field(self):
+        with pytest.raises(api.ParamException):
+            api.resources["products"]._resolve_field("gtin.foo")
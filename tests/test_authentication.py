@@ -0,0 +1,215 @@
+import json
+import os
+import time
+
+import pytest
+import rsa
+from jose import jwk, jwt
+from werkzeug.exceptions import Forbidden, ServiceUnavailable, Unauthorized
+
+from supermarket.authentication import Auth0, jwks_cache, token_cache
+
+
+def fake_jwk(kid):
+    return {"kty": "RSA", "kid": kid, "use": "sig", "n": "modulus-" + kid, "e": "AQAB"}
+
+
+@pytest.fixture(scope="module")
+def private_key():
+    """Return a PEM encoded private key for signing test tokens."""
+    _, private_key = rsa.newkeys(1024)
+    return private_key.save_pkcs1().decode()
+
+
+@pytest.fixture
+def jwks_file(app, tmp_path, monkeypatch, private_key):
+    """Use a local JWKS file instead of fetching the keys from Auth0."""
+    public_key = jwk.construct(private_key, "RS256").public_key().to_dict()
+    public_key.update({"kid": "key-1", "use": "sig"})
+    path = tmp_path / "jwks.json"
+    path.write_text(json.dumps({"keys": [public_key]}))
+    monkeypatch.setitem(app.config, "AUTH0_JWKS_FILE", str(path))
+    jwks_cache.clear()
+    token_cache.clear()
+    yield path
+    jwks_cache.clear()
+    token_cache.clear()
+
+
+@pytest.fixture
+def make_token(app, private_key):
+    def make_token(expires_in=3600, **claims):
+        claims.setdefault("aud", app.config["AUTH0_API_AUDIENCE"])
+        claims.setdefault("iss", "https://{}/".format(app.config["AUTH0_DOMAIN"]))
+        claims.setdefault("exp", int(time.time()) + expires_in)
+        return jwt.encode(claims, private_key, algorithm="RS256", headers={"kid": "key-1"})
+
+    return make_token
+
+
+class TestJWKSCache:
+    def test_get_key(self, app, jwks_file):
+        with app.app_context():
+            key = jwks_cache.get_key("key-1")
+        assert key["kid"] == "key-1"
+        assert key["kty"] == "RSA"
+
+    def test_cached_within_ttl(self, app, jwks_file):
+        with app.app_context():
+            jwks_cache.get_key("key-1")
+            jwks_file.write_text(json.dumps({"keys": []}))
+            assert jwks_cache.get_key("key-1")["kid"] == "key-1"
+
+    def test_refresh_after_ttl(self, app, jwks_file, monkeypatch):
+        monkeypatch.setitem(app.config, "AUTH0_JWKS_TTL", 0)
+        monkeypatch.setitem(app.config, "AUTH0_JWKS_MIN_REFRESH_INTERVAL", 0)
+        with app.app_context():
+            jwks_cache.get_key("key-1")
+            jwks_file.write_text(json.dumps({"keys": []}))
+            assert jwks_cache.get_key("key-1") is None
+
+    def test_refresh_on_unknown_kid(self, app, jwks_file, monkeypatch):
+        monkeypatch.setitem(app.config, "AUTH0_JWKS_MIN_REFRESH_INTERVAL", 0)
+        with app.app_context():
+            assert jwks_cache.get_key("key-2") is None
+            jwks_file.write_text(json.dumps({"keys": [fake_jwk("key-2")]}))
+            assert jwks_cache.get_key("key-2")["kid"] == "key-2"
+
+    def test_min_refresh_interval(self, app, jwks_file, monkeypatch):
+        monkeypatch.setitem(app.config, "AUTH0_JWKS_MIN_REFRESH_INTERVAL", 3600)
+        with app.app_context():
+            assert jwks_cache.get_key("key-2") is None
+            jwks_file.write_text(json.dumps({"keys": [fake_jwk("key-2")]}))
+            assert jwks_cache.get_key("key-2") is None
+
+    def test_stale_keys_while_failing(self, app, jwks_file, monkeypatch):
+        monkeypatch.setitem(app.config, "AUTH0_JWKS_TTL", 0)
+        monkeypatch.setitem(app.config, "AUTH0_JWKS_MIN_REFRESH_INTERVAL", 0)
+        with app.app_context():
+            jwks_cache.get_key("key-1")
+            jwks_file.write_text("not a key set")
+            assert jwks_cache.get_key("key-1")["kid"] == "key-1"
+        assert jwks_cache.stats["refreshes"] == 1
+        assert jwks_cache.stats["failures"] == 1
+        assert jwks_cache.stats["last_latency"] is not None
+
+    def test_circuit_breaker(self, app, jwks_file, monkeypatch):
+        monkeypatch.setitem(app.config, "AUTH0_JWKS_TTL", 0)
+        monkeypatch.setitem(app.config, "AUTH0_JWKS_MIN_REFRESH_INTERVAL", 0)
+        monkeypatch.setitem(app.config, "AUTH0_JWKS_FAILURE_THRESHOLD", 2)
+        monkeypatch.setitem(app.config, "AUTH0_JWKS_RETRY_AFTER", 3600)
+        with app.app_context():
+            jwks_cache.get_key("key-1")
+            jwks_file.write_text("not a key set")
+            for _ in range(5):
+                assert jwks_cache.get_key("key-1")["kid"] == "key-1"
+        assert jwks_cache.stats["failures"] == 2
+        assert jwks_cache.stats["open"] is True
+
+    def test_no_keys(self, app, jwks_file):
+        jwks_file.write_text("not a key set")
+        with app.app_context():
+            with pytest.raises(ServiceUnavailable):
+                jwks_cache.get_key("key-1")
+
+    def test_background_refresh(self, app, jwks_file, monkeypatch):
+        monkeypatch.setitem(app.config, "AUTH0_JWKS_TTL", 0.2)
+        monkeypatch.setitem(app.config, "AUTH0_JWKS_REFRESH_AHEAD", 0.1)
+        monkeypatch.setitem(app.config, "AUTH0_JWKS_MIN_REFRESH_INTERVAL", 0)
+        jwks_cache.start_refresher(app)
+        try:
+            for _ in range(50):
+                if jwks_cache.stats["refreshes"] >= 2:
+                    break
+                time.sleep(0.05)
+        finally:
+            jwks_cache.stop_refresher()
+        assert jwks_cache.stats["refreshes"] >= 2
+        assert "key-1" in jwks_cache.keys
+
+    def test_refresher_started_on_first_use(self, app, jwks_file, monkeypatch):
+        monkeypatch.setitem(app.config, "AUTH0_JWKS_BACKGROUND_REFRESH", True)
+        assert jwks_cache.refresher is None
+        try:
+            with app.app_context():
+                jwks_cache.get_key("key-1")
+            assert jwks_cache.refresher.is_alive()
+            assert jwks_cache.refresher_pid == os.getpid()
+        finally:
+            jwks_cache.stop_refresher()
+
+
+class TestTokenCache:
+    def test_verify_token(self, app, jwks_file, make_token):
+        token = make_token(sub="user-1")
+        with app.app_context():
+            payload, scopes = Auth0().verify_token(token)
+        assert payload["sub"] == "user-1"
+        assert scopes == frozenset()
+
+    def test_verified_token_is_cached(self, app, jwks_file, make_token, monkeypatch):
+        token = make_token(sub="user-1")
+        with app.app_context():
+            Auth0().verify_token(token)
+
+            def decode(*args, **kwargs):
+                raise AssertionError("The signature should not be checked again.")
+
+            monkeypatch.setattr(jwt, "decode", decode)
+            assert Auth0().verify_token(token)[0]["sub"] == "user-1"
+
+    def test_expired_token_is_not_used(self, app, jwks_file, make_token):
+        token = make_token(expires_in=-10)
+        with app.app_context():
+            token_cache.set(token, {"sub": "user-1", "exp": time.time() - 10}, frozenset())
+            with pytest.raises(Unauthorized):
+                Auth0().verify_token(token)
+
+    def test_size_limit(self, app, jwks_file, make_token, monkeypatch):
+        monkeypatch.setitem(app.config, "AUTH0_TOKEN_CACHE_SIZE", 2)
+        tokens = [make_token(sub="user-{}".format(i)) for i in range(3)]
+        with app.app_context():
+            for token in tokens:
+                Auth0().verify_token(token)
+            assert token_cache.get(tokens[0]) is None
+            assert token_cache.get(tokens[1])[0]["sub"] == "user-1"
+            assert token_cache.get(tokens[2])[0]["sub"] == "user-2"
+
+
+class TestScopes:
+    @pytest.fixture
+    def view(self, app, monkeypatch):
+        monkeypatch.setitem(app.config, "TESTING", False)
+        auth0 = Auth0()
+
+        @auth0.requires_auth
+        @auth0.requires_scope("write:products")
+        def view():
+            return "ok"
+
+        return view
+
+    def test_scope_from_verified_payload(self, app, jwks_file, make_token, monkeypatch, view):
+        token = make_token(scope="read:products write:products")
+        decoded = []
+        decode = jwt.decode
+
+        def counting_decode(*args, **kwargs):
+            decoded.append(args[0])
+            return decode(*args, **kwargs)
+
+        def get_unverified_claims(token):
+            raise AssertionError("The token should not be decoded again.")
+
+        monkeypatch.setattr(jwt, "decode", counting_decode)
+        monkeypatch.setattr(jwt, "get_unverified_claims", get_unverified_claims)
+        headers = {"Authorization": "Bearer " + token}
+        with app.test_request_context(headers=headers):
+            assert view() == "ok"
+        assert decoded == [token]
+
+    def test_missing_scope(self, app, jwks_file, make_token, view):
+        headers = {"Authorization": "Bearer " + make_token(scope="read:products")}
+        with app.test_request_context(headers=headers):
+            with pytest.raises(Forbidden):
+                view()
@@ -0,0 +1,104 @@
+import csv
+import io
+import os.path
+
+import pytest
+
+import supermarket.api as api
+import supermarket.model as m
+from supermarket.export import product_rows, write_csv
+
+url_for = api.api.url_for
+fixtures = os.path.join(os.path.dirname(__file__), "..", "fixtures", "csvs")
+
+
+def read(res):
+    return list(csv.reader(io.StringIO(res.data.decode())))
+
+
+def test_write_csv():
+    rows = [["a", "b"], [1, "x, y"], [2, ""], [3, None]]
+    chunks = list(write_csv(rows, chunk_size=2))
+    assert chunks == ["a,b\r\n", '1,"x, y"\r\n2,\r\n', "3,\r\n"]
+
+
+@pytest.mark.usefixtures("client_class", "db")
+class TestCsvExport:
+    @pytest.fixture(autouse=True)
+    def data(self, app, db):
+        with app.app_context():
+            if not m.Product.query.count():
+                retailer = m.Retailer(name="Hofer")
+                organic = m.Label(name={"en": "Organic"})
+                ghana = m.Origin(name={"en": "Ghana"})
+                cookies = m.Product(
+                    name={"en": "Cookies", "de": "Kekse"},
+                    gtin="9001234567890",
+                    brand=m.Brand(name="Happy Harvest", retailer=retailer),
+                    category=m.Category(name="Snacks and Sweets"),
+                    stores=[m.Store(name="Hofer Wien", retailer=retailer)],
+                    labels=[organic, m.Label(name={"en": "Fairtrade"})],
+                )
+                for weight, name in enumerate(["Flour", "Sugar", "Cocoa"], 1):
+                    ingredient = m.Ingredient(weight=weight, name={"en": name}, product=cookies)
+                    if name == "Cocoa":
+                        (ingredient.percentage, ingredient.origin) = (12, ghana)
+                tea = m.Product(name={"en": "Tea"}, labels=[organic])
+                db.session.add_all([cookies, tea])
+                db.session.commit()
+
+    def test_products(self):
+        res = self.client.get(url_for(api.ProductCsvExport))
+        assert res.status_code == 200
+        assert res.mimetype == "text/csv"
+        assert "products-products.csv" in res.headers["Content-Disposition"]
+        with open(os.path.join(fixtures, "Data_1_Example_Product.csv")) as f:
+            header = next(csv.reader(f))
+        rows = [dict(zip(header, row)) for row in read(res)[1:]]
+        assert rows[0]["Product ID"] == "1"
+        assert rows[0]["Date of entry"] == ""
+        assert rows[0]["Retailer"] == "Hofer"
+        assert rows[0]["Supermarket"] == "Hofer Wien"
+        assert rows[0]["Brand"] == "Happy Harvest"
+        assert rows[0]["Complete product Name"] == "Cookies"
+        assert rows[0]["Barcode Number (number below barcode)"] == "9001234567890"
+        assert rows[0]["Number Ingreadeants"] == "3"
+        assert rows[0]["Number Labels"] == "2"
+        assert rows[1]["Retailer"] == ""
+        assert rows[1]["Number Ingreadeants"] == "0"
+
+    def test_ingredients(self):
+        res = self.client.get(url_for(api.ProductCsvExport, sheet="ingredients", lang="en"))
+        rows = read(res)
+        assert rows[0][:7] == ["Product ID", "Retailer", "Product Name", "StoreBrand"] + [
+            "Ingredient 1",
+            "%",
+            "origin",
+        ]
+        assert len(rows[0]) == 4 + 3 * 3
+        assert rows[1] == ["1", "Hofer", "Cookies", "Yes"] + ["Flour", "", ""] + [
+            "Sugar",
+            "",
+            "",
+        ] + ["Cocoa", "12 %", "Ghana"]
+        assert rows[2] == ["2", "", "Tea", ""] + [""] * 9
+
+    def test_labels(self):
+        res = self.client.get(url_for(api.ProductCsvExport, sheet="labels", lang="de"))
+        rows = read(res)
+        assert rows[0][4:] == ["Anzahl", "Label 1", "No", "Label 2", "No"]
+        assert rows[1] == ["1", "Hofer", "Kekse", "Yes", "2", "", "", "", ""]
+        assert rows[2][4:7] == ["1", "", ""]
+
+        res = self.client.get(url_for(api.ProductCsvExport, sheet="labels"))
+        assert read(res)[1][5:] == ["Organic", "", "Fairtrade", ""]
+
+    def test_invalid_sheet(self):
+        res = self.client.get(url_for(api.ProductCsvExport, sheet="prices"))
+        assert res.status_code == 400
+        assert res.json["errors"][0]["field"] == "sheet"
+
+    def test_chunks(self, app):
+        with app.app_context():
+            rows = list(product_rows(m.db.session, "ingredients", chunk_size=1))
+        assert [row[0] for row in rows[1:]] == [1, 2]
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+import supermarket.api as api
+import supermarket.model as m
+
+url_for = api.api.url_for
+
+
+def lines(res):
+    return [json.loads(line) for line in res.data.decode().splitlines()]
+
+
+@pytest.mark.usefixtures("client_class", "db")
+class TestExport:
+    @pytest.fixture(autouse=True)
+    def data(self, app, db):
+        with app.app_context():
+            if not m.Product.query.count():
+                label = m.Label(name={"en": "Organic", "de": "Bio"})
+                for i in range(5):
+                    product = m.Product(
+                        name={"en": "Product {}".format(i), "de": "Produkt {}".format(i)},
+                        labels=[label] if i % 2 else [],
+                    )
+                    db.session.add(product)
+                db.session.commit()
+
+    def test_export(self):
+        res = self.client.get(url_for(api.ResourceExport, type="products"))
+        assert res.status_code == 200
+        assert res.mimetype == "application/x-ndjson"
+        items = lines(res)
+        assert [item["id"] for item in items] == [1, 2, 3, 4, 5]
+        assert items[1]["name"] == {"en": "Product 1", "de": "Produkt 1"}
+
+    def test_parameters(self):
+        url = url_for(
+            api.ResourceExport,
+            type="products",
+            only="id,name,labels",
+            lang="de",
+            include="labels.name",
+            sort="-id",
+            **{"name:like": "produkt"}
+        )
+        res = self.client.get(url)
+        assert lines(res) == [
+            {"id": 5, "name": "Produkt 4", "labels": []},
+            {"id": 4, "name": "Produkt 3", "labels": [{"name": "Bio"}]},
+            {"id": 3, "name": "Produkt 2", "labels": []},
+            {"id": 2, "name": "Produkt 1", "labels": [{"name": "Bio"}]},
+            {"id": 1, "name": "Produkt 0", "labels": []},
+        ]
+
+    def test_invalid_parameters(self):
+        url = url_for(api.ResourceExport, type="products")
+        res = self.client.get(url, query_string={"name:foo": "x"})
+        assert res.status_code == 400
+        assert res.json["errors"][0]["field"] == "name:foo"
+
+    def test_chunks(self, app):
+        url = url_for(api.ResourceExport, type="products", only="id,labels", include="labels.id")
+        with app.test_request_context(url):
+            response = api.resources["products"].export_list(chunk_size=2)
+            chunks = list(response.response)
+        assert len(chunks) == 3
+        items = [json.loads(line) for chunk in chunks for line in chunk.splitlines()]
+        assert [item["id"] for item in items] == [1, 2, 3, 4, 5]
+        assert items[3]["labels"] == [{"id": 1}]
@@ -78,3 +78,49 @@ def test_label_model_duplicate_name(db):
 
     with raises(IntegrityError):
         db.session.commit()
+
+
+def label_hotspots(db, label):
+    query = db.session.query(m.label_hotspots.c.hotspot_id)
+    query = query.filter(m.label_hotspots.c.label_id == label.id)
+    return sorted(row[0] for row in query)
+
+
+def test_label_hotspots(db):
+    climate = m.Hotspot(name={"en": "Climate"})
+    water = m.Hotspot(name={"en": "Water"})
+    criterion = m.Criterion(name={"en": "Less CO2"})
+    criterion.improves_hotspots.append(m.CriterionImprovesHotspot(hotspot=climate))
+    label = m.Label(name={"en": "Green"})
+    label.meets_criteria.append(m.LabelMeetsCriterion(criterion=criterion, score=1))
+    db.session.add(label)
+    db.session.commit()
+    assert label_hotspots(db, label) == [climate.id]
+    assert label.hotspots == [climate]
+
+    # criterion improves another hotspot
+    criterion.improves_hotspots.append(m.CriterionImprovesHotspot(hotspot=water))
+    db.session.commit()
+    assert label_hotspots(db, label) == [climate.id, water.id]
+
+    # label doesn’t meet the criterion anymore
+    label.meets_criteria = []
+    db.session.commit()
+    assert label_hotspots(db, label) == []
+
+
+def test_label_hotspots_deleted_with_label(db):
+    hotspot = m.Hotspot(name={"en": "Climate"})
+    criterion = m.Criterion(name={"en": "Less CO2"})
+    criterion.improves_hotspots.append(m.CriterionImprovesHotspot(hotspot=hotspot))
+    label = m.Label(name={"en": "Green"})
+    label.meets_criteria.append(m.LabelMeetsCriterion(criterion=criterion, score=1))
+    db.session.add(label)
+    db.session.commit()
+
+    db.session.delete(label)
+    db.session.commit()
+    assert db.session.query(m.label_hotspots).count() == 0
+
+    m.refresh_label_hotspots(db.session)
+    assert db.session.query(m.label_hotspots).count() == 0
@@ -0,0 +1,117 @@
+import math
+
+import pytest
+from flask import url_for
+
+import supermarket.model as m
+from supermarket.risk import RiskMatrix, get_risk_matrix, invalidate_risk_matrix
+
+
+def test_risk_matrix():
+    # supply ID, resource ID, origin ID
+    supplies = [(3, 1, 10), (1, 1, 11), (2, 1, 10), (4, 2, None), (5, 1, None)]
+    # supply ID, hotspot ID, score
+    scores = [(1, 7, 2), (2, 7, 6), (3, 7, 4), (3, 8, 1), (4, 8, 9), (5, 7, 100)]
+    matrix = RiskMatrix(supplies, scores)
+
+    assert matrix.supply_ids.tolist() == [1, 2, 3, 4, 5]
+    assert matrix.hotspot_ids.tolist() == [7, 8]
+    assert matrix.scores[0].tolist()[0] == 2
+    assert math.isnan(matrix.scores[0, 1])
+    assert matrix.by_resource[1].tolist() == [0, 1, 2, 4]
+    assert matrix.by_origin[10].tolist() == [1, 2]
+    assert -1 not in matrix.by_origin
+
+    profile = matrix.profile([3, 4, 99])
+    assert profile["supplies"] == [
+        {"id": 3, "hotspots": {7: 4, 8: 1}},
+        {"id": 4, "hotspots": {8: 9}},
+    ]
+    assert profile["hotspots"] == {
+        7: {"mean": 4, "max": 4, "supplies": 1},
+        8: {"mean": 5, "max": 9, "supplies": 2},
+    }
+    assert profile["unknown"] == [99]
+
+    assert matrix.origins_by_risk(1, 7) == [
+        {"origin": 10, "risk": 5, "supplies": 2},
+        {"origin": 11, "risk": 2, "supplies": 1},
+    ]
+    assert matrix.origins_by_risk(1, 7, limit=1) == [{"origin": 10, "risk": 5, "supplies": 2}]
+    assert matrix.origins_by_risk(1, 8) == [{"origin": 10, "risk": 1, "supplies": 1}]
+    assert matrix.origins_by_risk(1, 99) == []
+    assert matrix.origins_by_risk(99, 7) == []
+
+
+def test_empty_risk_matrix():
+    matrix = RiskMatrix([], [])
+    assert matrix.profile([1]) == {"supplies": [], "hotspots": {}, "unknown": [1]}
+    assert matrix.origins_by_risk(1, 1) == []
+
+
+@pytest.mark.usefixtures("client_class", "db")
+class TestRiskEndpoints:
+    @pytest.fixture(autouse=True)
+    def data(self, app, db):
+        # The matrix might have been built from another test’s database.
+        invalidate_risk_matrix()
+        with app.app_context():
+            if not m.Supply.query.count():
+                hotspot = m.Hotspot(name={"en": "Climate"})
+                cocoa = m.Resource(name={"en": "Cocoa"})
+                for (origin, score) in [("Ghana", 8), ("Peru", 3), ("Ghana", 6)]:
+                    supply = m.Supply(resource=cocoa, origin=m.Origin(name={"en": origin}))
+                    supply.scores.append(m.Score(hotspot=hotspot, score=score))
+                    db.session.add(supply)
+                db.session.commit()
+
+    def test_supply_profiles(self):
+        url = url_for("api.supplyhotspotprofiles")
+        res = self.client.get(url, query_string={"id:in": "1,2,42"})
+        assert res.status_code == 200
+        assert res.json["items"] == [
+            {"id": 1, "hotspots": {"1": 8.0}},
+            {"id": 2, "hotspots": {"1": 3.0}},
+        ]
+        assert res.json["hotspots"] == {"1": {"mean": 5.5, "max": 8.0, "supplies": 2}}
+        assert res.json["errors"][0]["errors"][0]["param"] == "id"
+
+        res = self.client.get(url, query_string={"id:in": "a,b"})
+        assert res.status_code == 400
+
+    def test_origins_by_risk(self):
+        url = url_for("api.resourceoriginsbyrisk", id=1)
+        res = self.client.get(url, query_string={"hotspot": 1})
+        assert res.status_code == 200
+        # each supply has its own origin
+        assert [o["risk"] for o in res.json["items"]] == [8.0, 6.0, 3.0]
+
+        res = self.client.get(url)
+        assert res.status_code == 400
+        assert res.json["errors"][0]["field"] == "hotspot"
+
+        res = self.client.get(
+            url_for("api.resourceoriginsbyrisk", id=42), query_string={"hotspot": 1}
+        )
+        assert res.status_code == 404
+
+    def test_rebuilt_when_scores_change(self):
+        url = url_for("api.supplyhotspotprofiles")
+        self.client.get(url, query_string={"id": 1})
+        matrix = get_risk_matrix(m.db.session)
+
+        score = m.Score.query.filter_by(supply_id=1).one()
+        score.score = 1
+        m.db.session.commit()
+        res = self.client.get(url, query_string={"id": 1})
+        assert res.json["items"] == [{"id": 1, "hotspots": {"1": 1.0}}]
+        assert get_risk_matrix(m.db.session) is not matrix
+        assert get_risk_matrix(m.db.session) is get_risk_matrix(m.db.session)
+
+    def test_rebuilt_after_writes_bypassing_the_orm(self):
+        matrix = get_risk_matrix(m.db.session)
+        m.db.session.execute(m.Score.__table__.update().values(score=2))
+        m.db.session.commit()
+        rebuilt = get_risk_matrix(m.db.session)
+        assert rebuilt is not matrix
+        assert rebuilt.profile([1])["hotspots"][1]["max"] == 2.0
@@ -0,0 +1,56 @@
+import pytest
+from flask import url_for
+
+import supermarket.api as api
+import supermarket.schema as s
+
+
+class TestFieldMetadata:
+    def test_field_kinds(self):
+        schema = s.Label()
+        assert schema.nested_fields == {"meets_criteria"}
+        assert "name" in schema.translated_fields
+        assert "resources" in schema.related_lists
+        assert "hotspots" not in schema.related_lists
+
+        schema = s.Product()
+        assert "brand" in schema.related_fields
+        assert "labels" in schema.related_lists
+
+    def test_computed_once_per_class(self):
+        assert s.Label().field_metadata() is s.Label.field_metadata()
+        assert s.Label.field_metadata() is not s.Product.field_metadata()
+        assert isinstance(s.Label.field_metadata()["translated"], frozenset)
+
+    def test_only_does_not_change_metadata(self):
+        assert s.Product(only=["name"]).related_fields == s.Product().related_fields
+
+
+class TestBuildUrl:
+    @pytest.mark.parametrize(
+        "values,key",
+        [
+            ({"type": "brands", "id": 5, "_external": True}, "id"),
+            ({"type": "brands", "id": 12345, "_external": False}, "id"),
+            ({"id:in": "1,2,3", "type": "products", "_external": True}, "id:in"),
+            ({"name": "ä b/+&=?", "type": "products", "_external": True}, "name"),
+            ({"type": "labels", "_external": True}, None),
+        ],
+    )
+    def test_same_as_url_for(self, app, values, key):
+        endpoint = "api.resourceitem" if "id" in values else "api.resourcelist"
+        for base_url in ["http://localhost/", "https://example.com:8080/", "http://localhost/"]:
+            with app.test_request_context(base_url=base_url):
+                assert s.build_url(endpoint, values, key) == url_for(endpoint, **values)
+
+
+@pytest.mark.usefixtures("client_class", "example_data_label_guide")
+class TestLinks:
+    def test_same_as_url_for(self, monkeypatch):
+        url = api.api.url_for(
+            api.ResourceList, type="labels", include="meets_criteria.criterion.all"
+        )
+        res = self.client.get(url)
+        assert any(i["links"]["related"]["criteria"] for i in res.json["items"])
+        monkeypatch.setattr(s, "_url_template", lambda *args: None)
+        assert self.client.get(url).data == res.data
@@ -0,0 +1,237 @@
+import pytest
+from flask import url_for
+
+import supermarket.model as m
+from supermarket import scoring
+
+
+def product_scores(db, product):
+    db.session.expire_all()
+    return db.session.query(m.ProductScore).get(product.id)
+
+
+def add_scored_products(db):
+    climate = m.Hotspot(name={"en": "Climate"})
+    criterion = m.Criterion(name={"en": "Less CO2"})
+    criterion.improves_hotspots.append(m.CriterionImprovesHotspot(hotspot=climate, weight=2))
+    green = m.Label(name={"en": "Green"}, details={"score": {"a": 50, "b": 70}})
+    green.meets_criteria.append(m.LabelMeetsCriterion(criterion=criterion, score=3))
+    grey = m.Label(name={"en": "Grey"}, details={"score": {"a": 10, "b": 30}})
+
+    cocoa = m.Resource(name={"en": "Cocoa"})
+    supply = m.Supply(resource=cocoa)
+    supply.scores.append(m.Score(hotspot=climate, score=4))
+    other_supply = m.Supply(resource=cocoa, origin=m.Origin(name={"en": "Ghana"}))
+    other_supply.scores.append(m.Score(hotspot=climate, score=10))
+
+    chocolate = m.Product(name={"en": "Chocolate"}, labels=[green, grey])
+    chocolate.ingredients.append(
+        m.Ingredient(weight=1, name={"en": "Cocoa"}, resource=cocoa, percentage=30)
+    )
+    chocolate.ingredients.append(
+        m.Ingredient(weight=2, name={"en": "Cocoa"}, resource=cocoa, origin=other_supply.origin)
+    )
+    biscuit = m.Product(name={"en": "Biscuit"}, labels=[grey])
+    water = m.Product(name={"en": "Water"})
+    db.session.add_all([chocolate, biscuit, water])
+    db.session.commit()
+    return (chocolate, biscuit, water, climate)
+
+
+def test_product_scores(db):
+    (chocolate, biscuit, water, climate) = add_scored_products(db)
+
+    scores = product_scores(db, chocolate)
+    assert scores.overall == 60
+    # both supplies match the first ingredient (30 %), only the second supply matches the
+    # second ingredient (the other 70 %) as its origin is known
+    risk = (30 * (4 + 10) / 2 + 70 * 10) / 100
+    assert scores.hotspots == {str(climate.id): {"improvement": 6, "risk": risk}}
+    assert product_scores(db, biscuit).overall == 20
+    assert product_scores(db, biscuit).hotspots == {}
+    assert product_scores(db, water).overall == 0
+
+
+def test_product_scores_updated(db):
+    (chocolate, biscuit, water, climate) = add_scored_products(db)
+
+    # label score changed
+    label = m.Label.query.filter(m.Label.name["en"].astext == "Grey").one()
+    label.details = {"score": {"a": 90}}
+    db.session.commit()
+    assert product_scores(db, biscuit).overall == 90
+    assert product_scores(db, chocolate).overall == 90
+
+    # criterion weight changed
+    cih = m.CriterionImprovesHotspot.query.one()
+    cih.weight = 1
+    db.session.commit()
+    assert product_scores(db, chocolate).hotspots[str(climate.id)]["improvement"] == 3
+
+    # supply score changed
+    for score in m.Score.query.all():
+        score.score = 1
+    db.session.commit()
+    assert product_scores(db, chocolate).hotspots[str(climate.id)]["risk"] == 1
+
+    # label removed from product
+    water.labels.append(label)
+    biscuit.labels = []
+    db.session.commit()
+    assert product_scores(db, biscuit).overall == 0
+    assert product_scores(db, water).overall == 90
+
+    # product removed from label
+    db.session.expire(water)
+    label.products.remove(water)
+    db.session.commit()
+    assert product_scores(db, water).overall == 0
+    label.products.append(water)
+    db.session.commit()
+    assert product_scores(db, water).overall == 90
+
+    # label deleted
+    db.session.delete(label)
+    db.session.commit()
+    assert product_scores(db, water).overall == 0
+    assert product_scores(db, chocolate).overall == 60
+
+    # ingredients deleted
+    chocolate.ingredients = []
+    db.session.commit()
+    assert product_scores(db, chocolate).hotspots[str(climate.id)]["risk"] is None
+
+
+def test_invalid_label_scores(db):
+    (chocolate, biscuit, water, climate) = add_scored_products(db)
+    label = m.Label.query.filter(m.Label.name["en"].astext == "Grey").one()
+
+    label.details = {"score": 80}
+    db.session.commit()
+    assert product_scores(db, biscuit).overall == 0
+
+    label.details = {"score": {"a": 40, "b": "n/a", "c": None}}
+    db.session.commit()
+    assert product_scores(db, biscuit).overall == 40
+
+
+def test_refresh_product_scores(db):
+    (chocolate, biscuit, water, climate) = add_scored_products(db)
+    db.session.query(m.ProductScore).delete()
+    db.session.commit()
+
+    scoring.refresh_product_scores(db.session)
+    db.session.commit()
+    assert db.session.query(m.ProductScore).count() == 3
+    assert product_scores(db, chocolate).overall == 60
+
+    db.session.delete(water)
+    db.session.commit()
+    assert db.session.query(m.ProductScore).count() == 2
+
+
+def test_sort_and_filter_by_scores(client, db):
+    (chocolate, biscuit, water, climate) = add_scored_products(db)
+    url = url_for("api.resourcelist", type="products")
+
+    res = client.get(url, query_string={"sort": "-scores.overall", "only": "id,scores"})
+    assert [p["id"] for p in res.json["items"]] == [chocolate.id, biscuit.id, water.id]
+    assert res.json["items"][2]["scores"] == {"overall": 0, "hotspots": {}}
+
+    res = client.get(url, query_string={"scores.overall:ge": "20", "sort": "scores.overall"})
+    assert [p["id"] for p in res.json["items"]] == [biscuit.id, chocolate.id]
+
+    hotspot = "scores.hotspots.{}.improvement".format(climate.id)
+    res = client.get(url, query_string={hotspot + ":gt": "5"})
+    assert [p["id"] for p in res.json["items"]] == [chocolate.id]
+
+
+def test_ingredient_shares(db):
+    product = m.Product(name={"en": "Muesli"})
+    for (weight, percentage) in [(1, None), (2, 40), (3, None), (4, None)]:
+        product.ingredients.append(
+            m.Ingredient(weight=weight, name={"en": "Grain"}, percentage=percentage)
+        )
+    db.session.add(product)
+    db.session.commit()
+
+    shares = db.session.execute(scoring.ingredient_shares([product.id]).select())
+    shares = {row.weight: row.share for row in shares}
+    # the remaining 60 % are split 1 : ⅓ : ¼ by position
+    rank_total = 1 + 1 / 3 + 1 / 4
+    assert shares[2] == 40
+    assert shares[1] == pytest.approx(60 / rank_total)
+    assert shares[3] == pytest.approx(60 / 3 / rank_total)
+    assert shares[4] == pytest.approx(60 / 4 / rank_total)
+
+
+def test_hotspot_profiles(client, db):
+    (chocolate, biscuit, water, climate) = add_scored_products(db)
+    url = url_for("api.producthotspotprofiles")
+
+    res = client.get(url, query_string={"id:in": "{},{},42".format(chocolate.id, water.id)})
+    assert res.status_code == 200
+    assert res.json["items"] == [
+        {
+            "id": chocolate.id,
+            "hotspots": {str(climate.id): {"risk": 9.1, "max": 10.0, "share": 100.0}},
+        },
+        {"id": water.id, "hotspots": {}},
+    ]
+    assert res.json["errors"][0]["errors"][0]["param"] == "id"
+
+    res = client.get(url)
+    assert res.status_code == 400
+
+
+def test_alternatives(client, db):
+    sweets = m.Category(name="sweets")
+    store = m.Store(name="Corner shop")
+    austria = m.LabelCountry(code="AT")
+    labels = [
+        m.Label(name={"en": name}, details={"score": {"a": score}}, countries=countries)
+        for (name, score, countries) in [
+            ("Best", 90, [austria]),
+            ("Good", 60, [m.LabelCountry(code="*")]),
+            ("Okay", 40, [m.LabelCountry(code="DE")]),
+            ("Bad", 10, []),
+        ]
+    ]
+    products = [
+        m.Product(name={"en": label.name["en"]}, category=sweets, labels=[label])
+        for label in labels
+    ]
+    products[2].stores.append(store)
+    other = m.Product(name={"en": "Other"}, category=m.Category(name="drinks"), labels=labels[:1])
+    db.session.add_all(products + [other])
+    db.session.commit()
+    (best, good, okay, bad) = [p.id for p in products]
+
+    def alternatives(product, **params):
+        url = url_for("api.productalternatives", id=product)
+        res = client.get(url, query_string=dict(params, only="id"))
+        assert res.status_code == 200
+        return [p["id"] for p in res.json["items"]]
+
+    assert alternatives(bad) == [best, good, okay]
+    assert alternatives(bad, limit=2) == [best, good]
+    assert alternatives(okay) == [best, good]
+    assert alternatives(best) == []
+    assert alternatives(other.id) == []
+    assert alternatives(bad, countries="AT") == [best, good]
+    assert alternatives(bad, countries="FR,DE") == [good, okay]
+    assert alternatives(bad, stores=str(store.id)) == [okay]
+
+    # the index follows category changes
+    products[0].category = other.category
+    db.session.commit()
+    assert alternatives(bad) == [good, okay]
+    assert alternatives(other.id) == []
+
+    res = client.get(url_for("api.productalternatives", id=42))
+    assert res.status_code == 404
+
+    for limit in ["a", "-1"]:
+        res = client.get(url_for("api.productalternatives", id=bad, limit=limit))
+        assert res.status_code == 400
+        assert res.json["errors"][0]["field"] == "limit"